@@ -0,0 +1,578 @@
+import json
+import os
+import re
+from functools import lru_cache
+
+import governor
+from catalog import Catalog
+from resolver import index_for, resolve_item_name, tokens
+from stockmonitor import monitor_for
+from storage import (
+    DEFAULT_STORE,
+    STORES_DIR,
+    allocate_order_id,
+    claim_message,
+    complete_message,
+    current_store,
+    load_orders,
+    load_rollups,
+    price_for_item,
+    release_message,
+    reserve_order_ids,
+    save_order,
+    transaction,
+    update_order_status,
+    use_store,
+    wait_for_message,
+)
+
+# Core agent logic, kept free of Streamlit so it is imported (and its heavy
+# objects built) once per process instead of on every app.py rerun. Functions
+# take the per-session `state` (st.session_state or any attribute object).
+
+MODEL_NAME = "gemini-2.5-flash"
+
+# ---------------- Inventory (only hardcoded domain data) -----------------
+INVENTORY = {
+    'milk': {'hindi': ['doodh'], 'qty': 10, 'unit': 'packet', 'price': 25.0},
+    'bread': {'hindi': ['bread'], 'qty': 5, 'unit': 'loaf', 'price': 35.0},
+    'rice': {'hindi': ['chawal'], 'qty': 8, 'unit': 'kilo', 'price': 80.0},
+    'maggi': {'hindi': ['maggi'], 'qty': 12, 'unit': 'packet', 'price': 15.0},
+}
+
+# Stores other than 'default' may ship their own catalog as
+# stores/<store_id>.inventory.json (same shape as INVENTORY). Either way it is
+# loaded into an array-backed Catalog with a search index.
+_store_inventories = {}
+
+def store_inventory(store_id: str = None) -> Catalog:
+    store_id = store_id or current_store()
+    inventory = _store_inventories.get(store_id)
+    if inventory is None:
+        path = os.path.join(STORES_DIR, f"{store_id}.inventory.json")
+        if store_id != DEFAULT_STORE and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                inventory = json.load(f)
+        else:
+            inventory = INVENTORY
+        inventory = _store_inventories[store_id] = Catalog.from_dict(inventory)
+    return inventory
+
+def inventory_for(state) -> Catalog:
+    return store_inventory(getattr(state, 'store_id', None))
+
+def base_inventory(state, rollups: dict = None):
+    """Opening stock minus everything sold in orders that have since been archived."""
+    archived = (rollups or load_rollups())['items']
+    opening = inventory_for(state).opening_stock()
+    return {k: max(0, qty - archived.get(k, 0)) for k, qty in opening.items()}
+
+# ---------------- Gemini Setup (cached per process) -----------------
+_models = {}  # api key -> model; only successful builds are kept, so a failed one is retried
+
+def get_model(api_key: str):
+    if not api_key:
+        return None
+    model = _models.get(api_key)
+    if model is None:
+        try:
+            import google.generativeai as genai
+            genai.configure(api_key=api_key)
+            model = genai.GenerativeModel(MODEL_NAME)
+        except Exception:
+            return None
+        _models[api_key] = model
+    return model
+
+# ---------------- Gemini Parsing -----------------
+_PROMPT_INTRO = ("You are an AI assistant for a small Indian kirana (grocery) store. "
+                 "Understand multilingual (Hinglish, Hindi, English) user utterances.")
+_PROMPT_RULES = """intent: one of [order, inventory_check, status, greeting, unknown]
+items: list of objects {{name, qty}} only if intent=order (normalize names to: {valid_items})
+response_text: A natural reply in the SAME language/style as user (mix if user mixes). \
+For order: confirm availability, price estimate (~just sum qty * 10 for demo), and delivery ETA \
+30 minutes. If insufficient stock, propose available qty.
+If status intent: summarize latest undelivered order progress realistically.
+If inventory_check: answer availability.
+If greeting: greet and offer help.
+If unknown: ask for clarification."""
+_PROMPT_CONTEXT = """INVENTORY (name: remaining_qty with unit):
+{inventory_block}
+
+ACTIVE ORDERS:
+{orders_block}"""
+
+PROMPT_TEMPLATE = f"""
+{_PROMPT_INTRO}
+Task: Given the USER_MESSAGE and current INVENTORY and ORDERS, output a concise JSON ONLY \
+(no extra text) with keys:
+{_PROMPT_RULES}
+Constraints: Return ONLY JSON. Do NOT hallucinate items not in inventory.
+
+{_PROMPT_CONTEXT}
+
+USER_MESSAGE: "{{user_message}}"
+"""
+
+# Several independent messages share one context block and one model call
+BATCH_PROMPT_TEMPLATE = f"""
+{_PROMPT_INTRO}
+Task: MESSAGES is a JSON list of independent customer messages, each with an id. \
+Using the shared INVENTORY and ORDERS, output a JSON array ONLY (no extra text) \
+with one object per message, with keys:
+id: the message id, exactly as given
+{_PROMPT_RULES}
+Constraints: Return ONLY the JSON array. Do NOT hallucinate items not in inventory.
+
+{_PROMPT_CONTEXT}
+
+MESSAGES: {{messages_json}}
+"""
+
+# Small catalogs go into the prompt whole; larger ones only contribute the
+# SKUs relevant to the message, so prompt size doesn't grow with the catalog.
+PROMPT_FULL_CATALOG_MAX = int(os.getenv('KIRANA_PROMPT_FULL_CATALOG_MAX', '50'))
+PROMPT_TOP_K = int(os.getenv('KIRANA_PROMPT_TOP_K', '20'))
+
+def prompt_items(catalog: Catalog, user_text: str):
+    if len(catalog) <= PROMPT_FULL_CATALOG_MAX:
+        return list(catalog)
+    return catalog.search(user_text, PROMPT_TOP_K)
+
+def _prompt_context(state, texts) -> dict:
+    catalog = inventory_for(state)
+    # Top-k per message, merged, so every message in a batch gets its own candidates
+    names = list(dict.fromkeys(n for t in texts for n in prompt_items(catalog, t)))
+    inventory_block = '\n'.join([
+        f"{name}: {state.inventory.get(name,0)} {info['unit']} (orig {info['qty']})"
+        for name, info in ((n, catalog[n]) for n in names)
+    ]) or 'No matching items'
+    orders_block = 'None' if not state.orders else '\n'.join([
+        f"Order#{o['id']} status={o['status']} items={o['items']}" for o in state.orders
+    ])
+    return {"valid_items": ', '.join(names), "inventory_block": inventory_block,
+            "orders_block": orders_block}
+
+def build_prompt(state, user_text: str) -> str:
+    return PROMPT_TEMPLATE.format(user_message=user_text, **_prompt_context(state, [user_text]))
+
+def build_batch_prompt(state, messages) -> str:
+    """messages: list of (msg_id, text)."""
+    messages_json = json.dumps([{"id": str(mid), "text": text} for mid, text in messages],
+                               ensure_ascii=False)
+    context = _prompt_context(state, [t for _, t in messages])
+    return BATCH_PROMPT_TEMPLATE.format(messages_json=messages_json, **context)
+
+def extract_json_block(raw: str):
+    # Remove code fences
+    raw = raw.strip()
+    if raw.startswith('```'):
+        raw = re.sub(r'^```[a-zA-Z0-9]*', '', raw).strip()
+    if raw.endswith('```'):
+        raw = raw[:-3].strip()
+    # Find first '{' and attempt to balance braces
+    start = raw.find('{')
+    end = raw.rfind('}')
+    if start == -1 or end == -1 or end < start:
+        return None
+    candidate = raw[start:end+1]
+    # Simple brace balance check
+    stack = 0
+    for ch in candidate:
+        if ch == '{':
+            stack += 1
+        elif ch == '}':
+            stack -= 1
+            if stack < 0:
+                return None
+    if stack != 0:
+        return None
+    return candidate
+
+# Cheap local guess at the intent, only used to order calls in the governor queue
+_GREETING_RE = re.compile(
+    r'^\s*(hi+|hello|hey|namaste|namaskar|नमस्ते|नमस्कार|good (morning|evening)'
+    r'|thanks?|thank you|shukriya|धन्यवाद)\b', re.I)
+_STATUS_RE = re.compile(r'order|status|kahan|kab|where|deliver|ऑर्डर|कहाँ|कहां|कब', re.I)
+
+def classify_priority(state, user_text: str) -> int:
+    index = index_for(inventory_for(state))
+    if any(index.exact.get(t) for t in tokens(user_text)):
+        return governor.PRIORITY_ORDER
+    if _STATUS_RE.search(user_text):
+        return governor.PRIORITY_STATUS
+    if _GREETING_RE.search(user_text):
+        return governor.PRIORITY_GREETING
+    return governor.PRIORITY_DEFAULT
+
+def busy_reply(error) -> str:
+    return f"Abhi bahut requests aa rahi hain, thodi der baad try karein. ({error})"
+
+def gemini_parse(state, model, user_text: str):
+    if model is None:
+        return {"intent": "unknown", "items": [],
+                "response_text": "Model not configured (set GOOGLE_API_KEY)."}
+    prompt = build_prompt(state, user_text)
+    priority = classify_priority(state, user_text)
+    last_error = None
+    for attempt in range(2):  # first try original prompt, second forced JSON if needed
+        try:
+            if attempt:
+                prompt += "\nReturn ONLY raw minified JSON starting with '{' and nothing else."
+            resp = governor.generate(model, prompt, priority)
+            raw_text = resp.text or ''
+            cleaned = extract_json_block(raw_text) or raw_text
+            data = json.loads(cleaned)
+            # Optionally store raw for debug
+            state.last_raw_model_output = raw_text
+            return data
+        except governor.ModelUnavailable as e:
+            # Breaker open / queue full / timed out: retrying would only add load
+            return {"intent": "unknown", "items": [], "response_text": busy_reply(e)}
+        except Exception as e:
+            last_error = e
+            state.last_raw_model_output = locals().get('raw_text', '')
+            continue
+    return {"intent": "unknown", "items": [], "response_text": f"Parsing error: {last_error}"}
+
+def extract_json_array(raw: str):
+    raw = raw.strip()
+    if raw.startswith('```'):
+        raw = re.sub(r'^```[a-zA-Z0-9]*', '', raw).strip()
+    if raw.endswith('```'):
+        raw = raw[:-3].strip()
+    start = raw.find('[')
+    end = raw.rfind(']')
+    if start == -1 or end == -1 or end < start:
+        return None
+    return raw[start:end+1]
+
+def gemini_parse_batch(state, model, messages) -> dict:
+    """One model call for several (msg_id, text) pairs.
+
+    Returns {str(msg_id): parsed} for the ids answered.
+    """
+    if model is None:
+        return {}
+    prompt = build_batch_prompt(state, messages)
+    priority = min(classify_priority(state, text) for _, text in messages)
+    wanted = {str(mid) for mid, _ in messages}
+    for attempt in range(2):
+        try:
+            if attempt:
+                prompt += "\nReturn ONLY a raw JSON array starting with '[' and nothing else."
+            resp = governor.generate(model, prompt, priority)
+            raw_text = resp.text or ''
+            data = json.loads(extract_json_array(raw_text) or raw_text)
+            state.last_raw_model_output = raw_text
+            results = {}
+            for entry in data:
+                if isinstance(entry, dict) and str(entry.get('id')) in wanted:
+                    results[str(entry.pop('id'))] = entry
+            return results
+        except governor.ModelUnavailable as e:
+            busy = busy_reply(e)
+            return {mid: {"intent": "unknown", "items": [], "response_text": busy}
+                    for mid in wanted}
+        except Exception:
+            state.last_raw_model_output = locals().get('raw_text', '')
+            continue
+    return {}  # callers fall back to gemini_parse per message
+
+# ---------------- Low Stock Monitoring Agent -----------------
+def check_low_stock_and_alert(state):
+    """Items below their low-stock threshold, for the shopkeeper dashboard (not added to chat).
+
+    The monitor is updated as orders change stock, so this doesn't rescan the inventory.
+    """
+    return monitor_for(state, inventory_for(state)).alerts()
+
+# ---------------- Order Handling -----------------
+def resolution_note(items) -> str:
+    """Reply suffix naming the catalog item each differently-named request was booked as."""
+    renamed = [f"{it['name']} → {it['matched']}" for it in items if it.get('matched')]
+    return ("\nℹ️ " + ', '.join(renamed)) if renamed else ''
+
+def apply_order(state, items, raw_request: str, response_text: str, request_msg_id: int = None,
+                order_id: int = None):
+    catalog = inventory_for(state)
+    unavailable = []
+    applied_pairs = []
+    detailed_items = []
+    total_amount = 0.0
+    for it in items:
+        # Map free-form names ("doodh packet", "chaawal") to catalog keys locally
+        name = resolve_item_name(catalog, it.get('name')) or it.get('name')
+        qty = int(it.get('qty',1) or 1)
+        if name not in state.inventory:
+            unavailable.append({"name": name, "reason": "not_found"})
+            continue
+        if state.inventory[name] < qty:
+            unavailable.append({"name": name, "reason": f"only {state.inventory[name]} left"})
+        else:
+            state.inventory[name] -= qty
+            monitor_for(state, catalog).update(name, state.inventory[name])
+            if name.lower() != str(it.get('name', '')).strip().lower():
+                it['matched'] = name  # booked under another name; the reply must say so
+            applied_pairs.append((name, qty))
+            unit_price = catalog.get(name, {}).get('price') or price_for_item(name)
+            line_total = unit_price * qty
+            total_amount += line_total
+            detailed_items.append({"name": name, "qty": qty, "unit_price": unit_price,
+                                   "line_total": line_total})
+    if not applied_pairs:
+        order_id = None
+    else:
+        # Callers inside storage.transaction() pass an id reserved beforehand
+        order_id = order_id or allocate_order_id()
+        response_text += resolution_note(items)
+        state.orders.append({"id": order_id, "items": applied_pairs, "status": "processing",
+                             "total_amount": total_amount})
+        save_order(order_id, 'processing', detailed_items, raw_request, response_text, total_amount,
+                   request_msg_id)
+
+    return applied_pairs, unavailable, order_id
+
+def _book_order(state, parsed: dict, user_text: str, request_msg_id: int = None,
+                order_id: int = None):
+    """apply_order() for a parsed order; records the outcome on parsed.
+
+    Returns the items that couldn't be booked.
+    """
+    items = parsed.get('items', [])
+    reply = parsed.get('response_text', '')
+    applied, unavailable, oid = apply_order(state, items, user_text, reply, request_msg_id,
+                                            order_id)
+    parsed['applied_items'] = applied
+    parsed['unavailable'] = unavailable
+    parsed['response_text'] = parsed.get('response_text', '') + resolution_note(items)
+    if oid:
+        parsed['order_id'] = oid
+    return unavailable
+
+def unavailable_note(unavailable) -> str:
+    return "\n" + ', '.join([f"⚠️ {u['name']}: {u['reason']}" for u in unavailable])
+
+def update_statuses(state):
+    for o in state.orders:
+        before = o['status']
+        if before == 'processing':
+            o['status'] = 'out-for-delivery'
+        elif before == 'out-for-delivery':
+            o['status'] = 'delivered'
+        if o['status'] != before:
+            update_order_status(o['id'], o['status'])
+
+def recompute_inventory_from_orders(state):
+    """Rebuild current inventory from the catalog minus all applied (and archived) order items.
+
+    Orders are reloaded as well: any archived since the session loaded them are now in
+    the rollups.
+    """
+    rollups = load_rollups()
+    state.orders = load_orders()
+    state.archived_order_count = rollups['order_count']
+    rebuilt = base_inventory(state, rollups)
+    for ord_row in state.orders:
+        for item_name, qty in ord_row.get('items', []):
+            if item_name in rebuilt:
+                rebuilt[item_name] = max(0, rebuilt[item_name] - qty)
+    state.inventory = rebuilt
+    monitor_for(state, inventory_for(state)).reset(rebuilt)
+
+def sync_archived_orders(state, rollups: dict):
+    """Reload if the retention worker archived orders since this session last loaded them."""
+    if getattr(state, 'archived_order_count', rollups['order_count']) != rollups['order_count']:
+        recompute_inventory_from_orders(state)
+
+# ---------------- LangGraph pipeline (compiled once per process) -----------------
+# Graph state is a dict: { user_text, session, model, parsed, request_msg_id }
+def gemini_node(state_dict: dict):
+    user_text = state_dict.get('user_text', '')
+    parsed = gemini_parse(state_dict['session'], state_dict['model'], user_text)
+    # attach original user text for downstream nodes
+    parsed['__user_text'] = user_text
+    state_dict['parsed'] = parsed
+    return state_dict
+
+def order_node(state_dict: dict):
+    parsed = state_dict.get('parsed',{})
+    model = state_dict.get('model')
+    if parsed.get('intent') == 'order':
+        user_text_local = parsed.get('__user_text','')
+        unavailable = _book_order(state_dict['session'], parsed, user_text_local,
+                                  state_dict.get('request_msg_id'))
+        # Stock shortfalls need no model call; only unresolvable names get an LLM clarification
+        short = [u for u in unavailable if u['reason'] != 'not_found']
+        not_found = [u for u in unavailable if u['reason'] == 'not_found']
+        if short:
+            parsed['response_text'] += unavailable_note(short)
+        if not_found:
+            unavailable_desc = ', '.join([f"{u['name']} ({u['reason']})" for u in not_found])
+            clarification_prompt = (f"User tried ordering items with issues: {unavailable_desc}. "
+                                    "Create a concise apology + suggestion in same language.")
+            if model:
+                try:
+                    alt = governor.generate(model, clarification_prompt,
+                                            governor.PRIORITY_ORDER).text.strip()
+                    parsed['response_text'] += "\n" + alt
+                except Exception:
+                    pass
+    state_dict['parsed'] = parsed
+    return state_dict
+
+def route_after_gemini(state_dict: dict):
+    intent = state_dict.get('parsed',{}).get('intent')
+    if intent == 'order':
+        return 'order'
+    return '__end__'  # langgraph.graph.END
+
+@lru_cache(maxsize=1)
+def get_graph():
+    try:
+        from langgraph.graph import END, StateGraph
+    except ImportError:
+        return None
+    graph = StateGraph(dict)
+    graph.add_node('gemini', gemini_node)
+    graph.add_node('order', order_node)
+    graph.set_entry_point('gemini')
+    graph.add_conditional_edges('gemini', route_after_gemini, {'order': 'order', END: END})
+    graph.add_edge('order', END)
+    return graph.compile()
+
+def process_user_message(state, model, user_text: str, idempotency_key: str = None,
+                         request_msg_id: int = None):
+    """Run one utterance through the pipeline.
+
+    With an idempotency_key, a repeat of the same client message (retry,
+    double click) returns the stored result with '__replayed' set, without
+    calling the model or writing another order. request_msg_id is the
+    chat_messages id of the saved utterance; an order made from it references
+    that message instead of storing the text again.
+    """
+    # Worker threads don't inherit the app's active store, so pin it per call
+    with use_store(getattr(state, 'store_id', None) or current_store()):
+        return _process_user_message(state, model, user_text, idempotency_key, request_msg_id)
+
+def _process_user_message(state, model, user_text: str, idempotency_key: str = None,
+                          request_msg_id: int = None):
+    if not idempotency_key:
+        return _run_pipeline(state, model, user_text, request_msg_id)
+    prior = claim_message(idempotency_key)
+    if prior is not None and prior['status'] == 'pending':
+        prior = wait_for_message(idempotency_key)
+    if prior is not None and prior['status'] == 'done' and prior['parsed'] is not None:
+        return _replayed(prior)
+    try:
+        parsed = _run_pipeline(state, model, user_text, request_msg_id)
+    except Exception:
+        release_message(idempotency_key)
+        raise
+    _finish_message(idempotency_key, parsed)
+    return parsed
+
+def _replayed(prior):
+    parsed = prior['parsed']
+    parsed['__replayed'] = True
+    parsed['__reply_saved'] = prior.get('reply_msg_id') is not None
+    return parsed
+
+def _finish_message(idempotency_key: str, parsed: dict):
+    # Parse errors, a busy model and a missing API key all come back as 'unknown';
+    # storing those would replay the error instead of retrying the model
+    if parsed.get('intent') in (None, 'unknown'):
+        release_message(idempotency_key)
+    else:
+        complete_message(idempotency_key, parsed, parsed.get('order_id'))
+
+def _run_pipeline(state, model, user_text: str, request_msg_id: int = None):
+    app_graph = get_graph()
+    if app_graph is None:
+        # Fallback sequential processing if langgraph not available
+        parsed = gemini_parse(state, model, user_text)
+        parsed['__user_text'] = user_text
+        if parsed.get('intent') == 'order':
+            _book_order(state, parsed, user_text, request_msg_id)
+        return parsed
+    final_state = app_graph.invoke({'user_text': user_text, 'session': state, 'model': model,
+                                    'request_msg_id': request_msg_id})
+    return final_state.get('parsed', {})
+
+def process_user_messages(state, model, batch):
+    """Run several independent utterances (e.g. a webhook burst) through one model call.
+
+    batch: list of dicts with 'id' and 'text', optionally 'idempotency_key' and
+    'request_msg_id' (as for process_user_message). Returns {id: parsed}.
+    Messages the batch reply misses are parsed one by one. Messages sharing an
+    idempotency key are processed once and all get that result. All resulting
+    orders and idempotency records are written in a single storage transaction.
+    """
+    with use_store(getattr(state, 'store_id', None) or current_store()):
+        return _process_user_messages(state, model, batch)
+
+def _process_user_messages(state, model, batch):
+    # A key repeated within the batch would wait on its own claim; process it once
+    first_for_key, duplicates, unique = {}, {}, []
+    for msg in batch:
+        key = msg.get('idempotency_key')
+        if key in first_for_key:
+            duplicates[msg['id']] = first_for_key[key]
+            continue
+        if key:
+            first_for_key[key] = msg['id']
+        unique.append(msg)
+    results = _process_unique_messages(state, model, unique)
+    for msg_id, first_id in duplicates.items():
+        results[msg_id] = dict(results[first_id], __replayed=True)
+    return results
+
+def _process_unique_messages(state, model, batch):
+    results = {}
+    todo = []
+    for msg in batch:
+        key = msg.get('idempotency_key')
+        if key:
+            prior = claim_message(key)
+            if prior is not None and prior['status'] == 'pending':
+                prior = wait_for_message(key)
+            if prior is not None and prior['status'] == 'done' and prior['parsed'] is not None:
+                results[msg['id']] = _replayed(prior)
+                continue
+        todo.append(msg)
+    if not todo:
+        return results
+    try:
+        batched = {}
+        if len(todo) > 1:
+            batched = gemini_parse_batch(state, model, [(m['id'], m['text']) for m in todo])
+        parsed_list = [batched.get(str(m['id'])) or gemini_parse(state, model, m['text'])
+                       for m in todo]
+        # Ids are taken up front: leasing inside the transaction would need a second write lock
+        n_orders = sum(1 for p in parsed_list if p.get('intent') == 'order')
+        order_ids = iter(reserve_order_ids(n_orders))
+        inventory_before, orders_before = dict(state.inventory), list(state.orders)
+        try:
+            with transaction():
+                for m, parsed in zip(todo, parsed_list):
+                    parsed['__user_text'] = m['text']
+                    if parsed.get('intent') == 'order':
+                        unavailable = _book_order(state, parsed, m['text'], m.get('request_msg_id'),
+                                                  next(order_ids))
+                        if unavailable:
+                            # No per-message clarification call in a batch; a templated note instead
+                            parsed['response_text'] += unavailable_note(unavailable)
+                    if m.get('idempotency_key'):
+                        _finish_message(m['idempotency_key'], parsed)
+                    results[m['id']] = parsed
+        except Exception:
+            # Nothing was written; undo the in-memory stock and order changes too
+            state.inventory, state.orders = inventory_before, orders_before
+            monitor_for(state, inventory_for(state)).reset(state.inventory)
+            raise
+    except Exception:
+        for m in todo:
+            if m.get('idempotency_key'):
+                release_message(m['idempotency_key'])
+        raise
+    return results
@@ -1,63 +1,105 @@
+import hashlib
+import io
 import os
-import json
 import re
-import io
+import uuid
 from datetime import datetime
+
 import streamlit as st
-from langgraph.graph import StateGraph, END
-from gtts import gTTS
-import streamlit.components.v1 as components
 from streamlit_js_eval import streamlit_js_eval
-from dotenv import load_dotenv
-
-load_dotenv()
-
-import google.generativeai as genai
-
-from storage import init_db, save_order, update_order_status, load_orders, save_chat, load_chat, price_for_item
 
-
-# ---------------- Inventory (only hardcoded domain data) -----------------
-INVENTORY = {
-    'milk': {'hindi': ['doodh'], 'qty': 10, 'unit': 'packet', 'price': 25.0},
-    'bread': {'hindi': ['bread'], 'qty': 5, 'unit': 'loaf', 'price': 35.0},
-    'rice': {'hindi': ['chawal'], 'qty': 8, 'unit': 'kilo', 'price': 80.0},
-    'maggi': {'hindi': ['maggi'], 'qty': 12, 'unit': 'packet', 'price': 15.0},
-}
+from agent import (
+    check_low_stock_and_alert,
+    get_model,
+    inventory_for,
+    process_user_message,
+    recompute_inventory_from_orders,
+    sync_archived_orders,
+    update_statuses,
+)
+from governor import get_governor
+from render import chat_html, inventory_html, orders_html, search_result_html, shown_items
+from stockmonitor import forecast, monitor_for
+from storage import (
+    DEFAULT_STORE,
+    SLOW_QUERY_MS,
+    activate_store,
+    all_store_summaries,
+    archive_old_data,
+    init_db,
+    load_chat,
+    load_rollups,
+    max_order_id,
+    query_stats,
+    query_stats_since,
+    record_reply,
+    reset_query_stats,
+    save_chat,
+    search,
+    slow_queries,
+    start_retention_worker,
+    store_exists,
+    transaction,
+)
+
+
+@st.cache_resource
+def _load_env():
+    # .env only needs reading once per process, not on every rerun
+    from dotenv import load_dotenv
+    load_dotenv()
+
+_load_env()
+
+def _requested_store():
+    # ?store=<id> in the URL, else KIRANA_STORE_ID, else the default store (data.db).
+    # Visitors can only pick stores that exist or are allow-listed (KIRANA_ALLOWED_STORES);
+    # anything else falls back to the default instead of creating a database.
+    try:
+        store_id = st.query_params.get('store')
+    except Exception:
+        store_id = None
+    if store_id and store_exists(store_id):
+        return store_id
+    store_id = os.getenv('KIRANA_STORE_ID')
+    if store_id and store_exists(store_id):
+        return store_id
+    return DEFAULT_STORE
 
 # ---------------- Session State Initialization -----------------
 state = st.session_state
+if 'store_id' not in state:
+    state.store_id = _requested_store()
+activate_store(state.store_id)
 if 'orders' not in state:
     state.orders = []
 if 'inventory' not in state:
-    state.inventory = {k: v['qty'] for k, v in INVENTORY.items()}
+    state.inventory = inventory_for(state).opening_stock()
 if 'chat' not in state:
     state.chat = []  # list of {role:'user'|'assistant', 'text': str}
-if 'order_counter' not in state:
-    state.order_counter = 1
 if 'chat_loaded' not in state:
     init_db()
+    start_retention_worker()
     # load persisted
-    loaded_orders = load_orders()
-    if loaded_orders:
-        state.orders = loaded_orders
-        if loaded_orders[-1]['id'] >= state.order_counter:
-            state.order_counter = loaded_orders[-1]['id'] + 1
     state.chat = load_chat()
     state.chat_loaded = True
-    # After loading historical orders, recompute inventory so it reflects past orders
-    base_inventory = {k: v['qty'] for k, v in INVENTORY.items()}
-    for _ord in state.orders:
-        for item_name, qty in _ord['items']:
-            if item_name in base_inventory:
-                base_inventory[item_name] = max(0, base_inventory[item_name] - qty)
-    state.inventory = base_inventory
+    # Loads historical orders and recomputes inventory so it reflects them
+    recompute_inventory_from_orders(state)
 if 'manual_text_input' not in state:
     state.manual_text_input = ''
 if 'msg_input_value' not in state:
     state.msg_input_value = ''
 if 'voice_input_counter' not in state:
     state.voice_input_counter = 0
+if 'client_id' not in state:
+    state.client_id = uuid.uuid4().hex
+if 'low_stock_toasts' not in state:
+    state.low_stock_toasts = []
+# The monitor calls back when an order takes an item below its threshold; toast it on the dashboard
+_monitor = monitor_for(state, inventory_for(state))
+if state.get('toast_monitor') is not _monitor:
+    _monitor.subscribe(lambda item, stock: state.low_stock_toasts.append((item, stock)))
+    state.toast_monitor = _monitor
 # ---------------- Gemini Setup (support st.secrets) -----------------
 def _fetch_api_key():
     # Priority: st.secrets (flat), st.secrets["google"]["api_key"], then environment
@@ -69,20 +111,14 @@ def _fetch_api_key():
     return os.getenv('GOOGLE_API_KEY')
 
 API_KEY = _fetch_api_key()
-if API_KEY and genai:
-    try:
-        genai.configure(api_key=API_KEY)
-        model = genai.GenerativeModel("gemini-2.5-flash")
-    except Exception:
-        model = None
-else:
-    model = None
+model = get_model(API_KEY)  # built once per process and shared by all sessions/reruns
 
 # ---------------- Utility: Text-To-Speech -----------------
 
 
 def speak(text: str):
     try:
+        from gtts import gTTS
         lang = 'hi' if re.search(r'[\u0900-\u097F]', text) else 'en'
         bio = io.BytesIO()
         gTTS(text=text, lang=lang).write_to_fp(bio)
@@ -91,146 +127,6 @@ def speak(text: str):
     except Exception as e:
         st.warning(f"TTS failed: {e}")
 
-# ---------------- Gemini Parsing -----------------
-PROMPT_TEMPLATE = """
-You are an AI assistant for a small Indian kirana (grocery) store. Understand multilingual (Hinglish, Hindi, English) user utterances.
-Task: Given the USER_MESSAGE and current INVENTORY and ORDERS, output a concise JSON ONLY (no extra text) with keys:
-intent: one of [order, inventory_check, status, greeting, unknown]
-items: list of objects {{name, qty}} only if intent=order (normalize names to: {valid_items})
-response_text: A natural reply in the SAME language/style as user (mix if user mixes). For order: confirm availability, price estimate (~just sum qty * 10 for demo), and delivery ETA 30 minutes. If insufficient stock, propose available qty.
-If status intent: summarize latest undelivered order progress realistically.
-If inventory_check: answer availability.
-If greeting: greet and offer help.
-If unknown: ask for clarification.
-Constraints: Return ONLY JSON. Do NOT hallucinate items not in inventory.
-
-INVENTORY (name: remaining_qty with unit):
-{inventory_block}
-
-ACTIVE ORDERS:
-{orders_block}
-
-USER_MESSAGE: "{user_message}"
-"""
-
-def gemini_parse(user_text: str):
-    inventory_block = '\n'.join([
-        f"{name}: {state.inventory.get(name,0)} {INVENTORY[name]['unit']} (orig {INVENTORY[name]['qty']})" for name in INVENTORY
-    ])
-    orders_block = 'None' if not state.orders else '\n'.join([
-        f"Order#{o['id']} status={o['status']} items={o['items']}" for o in state.orders
-    ])
-    prompt = PROMPT_TEMPLATE.format(
-        valid_items=', '.join(INVENTORY.keys()),
-        inventory_block=inventory_block,
-        orders_block=orders_block,
-        user_message=user_text
-    )
-    def extract_json_block(raw: str):
-        # Remove code fences
-        raw = raw.strip()
-        if raw.startswith('```'):
-            raw = re.sub(r'^```[a-zA-Z0-9]*', '', raw).strip()
-        if raw.endswith('```'):
-            raw = raw[:-3].strip()
-        # Find first '{' and attempt to balance braces
-        start = raw.find('{')
-        end = raw.rfind('}')
-        if start == -1 or end == -1 or end < start:
-            return None
-        candidate = raw[start:end+1]
-        # Simple brace balance check
-        stack = 0
-        for ch in candidate:
-            if ch == '{':
-                stack += 1
-            elif ch == '}':
-                stack -= 1
-                if stack < 0:
-                    return None
-        if stack != 0:
-            return None
-        return candidate
-
-    last_error = None
-    for attempt in range(2):  # first try original prompt, second forced JSON if needed
-        try:
-            resp = model.generate_content(prompt if attempt == 0 else prompt + "\nReturn ONLY raw minified JSON starting with '{' and nothing else.")
-            raw_text = resp.text or ''
-            cleaned = extract_json_block(raw_text) or raw_text
-            data = json.loads(cleaned)
-            # Optionally store raw for debug
-            state.last_raw_model_output = raw_text
-            return data
-        except Exception as e:
-            last_error = e
-            state.last_raw_model_output = locals().get('raw_text', '')
-            continue
-    return {"intent": "unknown", "items": [], "response_text": f"Parsing error: {last_error}"}
-
-# ---------------- Low Stock Monitoring Agent -----------------
-def check_low_stock_and_alert():
-    """Auto stock monitoring agent - checks for low inventory but doesn't add to chat"""
-    low_stock_items = []
-    for item, stock in state.inventory.items():
-        # Consider stock low if less than 5 units
-        if stock < 5:
-            low_stock_items.append(f"{item} ({stock} left)")
-    
-    if low_stock_items:
-        # Just return the alert info for shopkeeper dashboard, don't add to chat
-        return low_stock_items
-    return []
-
-# ---------------- Order Handling -----------------
-def apply_order(items, raw_request:str, response_text:str):
-    unavailable = []
-    applied_pairs = []
-    detailed_items = []
-    total_amount = 0.0
-    for it in items:
-        name = it.get('name')
-        qty = int(it.get('qty',1) or 1)
-        if name not in state.inventory:
-            unavailable.append({"name": name, "reason": "not_found"})
-            continue
-        if state.inventory[name] < qty:
-            unavailable.append({"name": name, "reason": f"only {state.inventory[name]} left"})
-        else:
-            state.inventory[name] -= qty
-            applied_pairs.append((name, qty))
-            unit_price = price_for_item(name)
-            line_total = unit_price * qty
-            total_amount += line_total
-            detailed_items.append({"name": name, "qty": qty, "unit_price": unit_price, "line_total": line_total})
-    order_id = None
-    if applied_pairs:
-        order_id = state.order_counter
-        state.order_counter += 1
-        state.orders.append({"id": order_id, "items": applied_pairs, "status": "processing", "total_amount": total_amount})
-        save_order(order_id, 'processing', detailed_items, raw_request, response_text, total_amount)
-    
-    return applied_pairs, unavailable, order_id
-
-def update_statuses():
-    for o in state.orders:
-        before = o['status']
-        if before == 'processing':
-            o['status'] = 'out-for-delivery'
-        elif before == 'out-for-delivery':
-            o['status'] = 'delivered'
-        if o['status'] != before:
-            update_order_status(o['id'], o['status'])
-
-def recompute_inventory_from_orders():
-    """Rebuild current inventory from the original INVENTORY minus all applied order items."""
-    rebuilt = {k: v['qty'] for k, v in INVENTORY.items()}
-    for ord_row in state.orders:
-        for item_name, qty in ord_row.get('items', []):
-            if item_name in rebuilt:
-                rebuilt[item_name] = max(0, rebuilt[item_name] - qty)
-    state.inventory = rebuilt
-
 # -------- Rerun helper (handles Streamlit version differences) --------
 def force_rerun():
     if hasattr(st, 'rerun'):
@@ -238,109 +134,53 @@ def force_rerun():
     elif hasattr(st, 'experimental_rerun'):
         st.experimental_rerun()
 
-def _build_graph():
-
-
-    # State will be a dict: { user_text, parsed }
-    graph = StateGraph(dict)
-
-    def gemini_node(state_dict: dict):
-        user_text = state_dict.get('user_text', '')
-        parsed = gemini_parse(user_text)
-        # attach original user text for downstream nodes
-        parsed['__user_text'] = user_text
-        state_dict['parsed'] = parsed
-        return state_dict
-
-    def order_node(state_dict: dict):
-        parsed = state_dict.get('parsed',{})
-        if parsed.get('intent') == 'order':
-            user_text_local = parsed.get('__user_text','')
-            applied, unavailable, oid = apply_order(parsed.get('items', []), user_text_local, parsed.get('response_text',''))
-            parsed['applied_items'] = applied
-            parsed['unavailable'] = unavailable
-            if oid:
-                parsed['order_id'] = oid
-            # Optional refinement when unavailable
-            if unavailable:
-                unavailable_desc = ', '.join([f"{u['name']} ({u['reason']})" for u in unavailable])
-                clarification_prompt = f"User tried ordering items with issues: {unavailable_desc}. Create a concise apology + suggestion in same language."  # noqa
-                if model:
-                    try:
-                        alt = model.generate_content(clarification_prompt).text.strip()
-                        parsed['response_text'] += "\n" + alt
-                    except Exception:
-                        pass
-        state_dict['parsed'] = parsed
-        return state_dict
-
-    def route_after_gemini(state_dict: dict):
-        intent = state_dict.get('parsed',{}).get('intent')
-        if intent == 'order':
-            return 'order'
-        return END
-
-    graph.add_node('gemini', gemini_node)
-    graph.add_node('order', order_node)
-    graph.set_entry_point('gemini')
-    graph.add_conditional_edges('gemini', route_after_gemini, {'order': 'order', END: END})
-    graph.add_edge('order', END)
-    return graph.compile()
-
-APP_GRAPH = _build_graph()
-
-def process_user_message(user_text: str):
-    if APP_GRAPH is None:
-        # Fallback sequential processing if langgraph not available
-        parsed = gemini_parse(user_text)
-        parsed['__user_text'] = user_text
-        if parsed.get('intent') == 'order':
-            applied, unavailable, oid = apply_order(parsed.get('items', []), user_text, parsed.get('response_text',''))
-            parsed['applied_items'] = applied
-            parsed['unavailable'] = unavailable
-            if oid:
-                parsed['order_id'] = oid
-        return parsed
-    final_state = APP_GRAPH.invoke({'user_text': user_text})
-    return final_state.get('parsed', {})
-
-
-
-
 # ---------------- UI Layout -----------------
 st.set_page_config(page_title="Kirana AI Agent", layout="wide")
 tabs = st.tabs(["Customer App", "Shopkeeper Dashboard"])  # Could add Analytics later
 
 def render_shopkeeper_dashboard(key_prefix: str = "shop_tab"):
     st.header("🏪 Shopkeeper Dashboard")
+
+    # Orders archived by the retention worker move into the rollups; don't count them twice
+    rollups = load_rollups()
+    sync_archived_orders(state, rollups)
     
+    while state.low_stock_toasts:
+        item, stock = state.low_stock_toasts.pop(0)
+        st.toast(f"⚠️ {item.title()} is running low ({stock} left)")
+
     # Check for low stock and show alert
-    low_stock_items = check_low_stock_and_alert()
+    low_stock_items = check_low_stock_and_alert(state)
     if low_stock_items:
         st.error(f"⚠️ **LOW STOCK ALERT**: {', '.join(low_stock_items)}. Please restock these items!")
     
     # Simple inventory table
     st.subheader("📦 Inventory")
+    catalog = inventory_for(state)
+    monitor = monitor_for(state, catalog)
+    # Large catalogs: same cap as the inventory cards, low-stock items first
+    shown, hidden = shown_items(state.inventory, monitor)
     inventory_data = []
-    for item_name in INVENTORY:
+    for item_name in shown:
         current_stock = state.inventory.get(item_name, 0)
-        unit = INVENTORY[item_name]['unit']
-        price = INVENTORY[item_name]['price']
+        info = catalog[item_name]
         
         inventory_data.append({
             'Item': item_name.title(),
-            'Stock': f"{current_stock} {unit}",
-            'Price': f"₹{price:.2f}",
-            'Status': "🔴 Low" if current_stock < 5 else "✅ OK"
+            'Stock': f"{current_stock} {info['unit']}",
+            'Price': f"₹{info['price']:.2f}",
+            'Status': "🔴 Low" if monitor.is_low(item_name, current_stock) else "✅ OK"
         })
     
     st.dataframe(inventory_data, use_container_width=True)
+    if hidden:
+        st.caption(f"Showing {len(shown)} of {len(shown) + hidden} items (low stock first).")
     
     # Metrics row
     col1, col2, col3, col4 = st.columns(4)
-    
+
     with col1:
-        total_orders = len(state.orders)
+        total_orders = len(state.orders) + rollups['order_count']
         st.markdown(f"""
         <div class="metric-card">
             <h3 style="color: #128c7e; margin: 0;">📦 {total_orders}</h3>
@@ -349,7 +189,8 @@ def render_shopkeeper_dashboard(key_prefix: str = "shop_tab"):
         """, unsafe_allow_html=True)
     
     with col2:
-        total_revenue = sum(o.get('total_amount', 0) for o in state.orders if o.get('status') == 'delivered')
+        total_revenue = rollups['revenue'] + sum(o.get('total_amount', 0) for o in state.orders
+                                                 if o.get('status') == 'delivered')
         st.markdown(f"""
         <div class="metric-card">
             <h3 style="color: #25d366; margin: 0;">₹{total_revenue:.0f}</h3>
@@ -367,7 +208,7 @@ def render_shopkeeper_dashboard(key_prefix: str = "shop_tab"):
         """, unsafe_allow_html=True)
     
     with col4:
-        low_stock_count = len([k for k in state.inventory if state.inventory.get(k, 0) < 5])
+        low_stock_count = len(monitor.low)
         st.markdown(f"""
         <div class="metric-card">
             <h3 style="color: #dc3545; margin: 0;">⚠️ {low_stock_count}</h3>
@@ -380,69 +221,42 @@ def render_shopkeeper_dashboard(key_prefix: str = "shop_tab"):
     # Inventory Section
     st.markdown("### 📦 Inventory Status")
     
-    # Display inventory in a cleaner way
-    for item, stock in state.inventory.items():
-        unit = INVENTORY[item]['unit']
-        price = INVENTORY[item]['price']
-        is_low_stock = stock < 5
-        
-        card_class = "inventory-card low-stock" if is_low_stock else "inventory-card"
-        status_icon = "⚠️" if is_low_stock else "✅"
-        
-        st.markdown(f"""
-        <div class="{card_class}">
-            <div style="display: flex; justify-content: space-between; align-items: center;">
-                <div>
-                    <h4 style="margin: 0; color: #333;">{status_icon} {item}</h4>
-                    <p style="margin: 5px 0 0 0; color: #666;">₹{price}/{unit}</p>
-                </div>
-                <div style="text-align: right;">
-                    <h3 style="margin: 0; color: {'#dc3545' if is_low_stock else '#25d366'};">{stock}</h3>
-                    <p style="margin: 0; color: #666;">{unit}s</p>
-                </div>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
+    # Display inventory in a cleaner way (one element for all cards)
+    st.markdown(inventory_html(catalog, state.inventory, monitor), unsafe_allow_html=True)
     
+    # Reorder forecast from the last FORECAST_WINDOW_DAYS of order_items
+    with st.expander("📈 Reorder Forecast"):
+        # Recomputed only when an order is stored (by any session), this session's stock
+        # changes or the day rolls over, not on every rerun
+        forecast_key = (id(catalog), max_order_id(), monitor.changes, datetime.utcnow().date())
+        cached = state.get('forecast_cache')
+        if cached is None or cached[0] != forecast_key:
+            try:
+                cached = (forecast_key, forecast(catalog, state.inventory))
+            except ImportError:
+                cached = (forecast_key, None)
+            state.forecast_cache = cached
+        rows = cached[1]
+        if rows is None:
+            st.info("Install numpy to enable consumption forecasting.")
+        elif rows:
+            st.dataframe([
+                {'Item': r['name'].title(), 'Stock': r['stock'],
+                 'Sold / day': f"{r['daily_rate']:.1f}",
+                 'Days of cover': ('∞' if r['days_of_cover'] == float('inf')
+                                   else f"{r['days_of_cover']:.1f}"),
+                 'Reorder': str(r['reorder_qty'] or '—')}
+                for r in rows
+            ], use_container_width=True)
+
     st.markdown("<br>", unsafe_allow_html=True)
     
     # Orders Section
     st.markdown("### 📋 Recent Orders")
     
     if state.orders:
-        for order in state.orders[-10:][::-1]:  # Show last 10 orders
-            status = order.get('status', 'processing')
-            total = order.get('total_amount', 0.0)
-            items_text = ', '.join([f"{qty} {name}" for name, qty in order['items']])
-            
-            status_colors = {
-                'processing': '#ffc107',
-                'out-for-delivery': '#17a2b8', 
-                'delivered': '#28a745'
-            }
-            
-            status_icons = {
-                'processing': '🔄',
-                'out-for-delivery': '🚚',
-                'delivered': '✅'
-            }
-            
-            st.markdown(f"""
-            <div class="order-card status-{status}">
-                <div style="display: flex; justify-content: space-between; align-items: center;">
-                    <div>
-                        <h4 style="margin: 0; color: #333;">{status_icons.get(status, '📦')} Order #{order['id']}</h4>
-                        <p style="margin: 5px 0; color: #666;">{items_text}</p>
-                        <span style="background: {status_colors.get(status, '#6c757d')}; color: white; padding: 3px 8px; border-radius: 15px; font-size: 12px;">
-                            {status.replace('-', ' ').title()}
-                        </span>
-                    </div>
-                    <div style="text-align: right;">
-                        <h3 style="margin: 0; color: #25d366;">₹{total:.2f}</h3>
-                    </div>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+        # Show last 10 orders
+        st.markdown(orders_html(state.orders, limit=10), unsafe_allow_html=True)
         
         st.markdown("<br>", unsafe_allow_html=True)
         
@@ -452,22 +266,33 @@ def render_shopkeeper_dashboard(key_prefix: str = "shop_tab"):
         
         with col_a:
             if st.button("🔄 Update Order Status", key=f"{key_prefix}_prog_status", use_container_width=True):
-                update_statuses()
+                update_statuses(state)
                 st.success("Order statuses updated!")
                 force_rerun()
         
         with col_b:
             if st.button("🔄 Reload from Database", key=f"{key_prefix}_reload_db", use_container_width=True):
-                state.orders = load_orders()
                 state.chat = load_chat()
-                recompute_inventory_from_orders()
+                recompute_inventory_from_orders(state)
                 st.success("Data reloaded from database!")
                 force_rerun()
         
         with col_c:
             if st.button("📊 Recompute Inventory", key=f"{key_prefix}_recompute_inv", use_container_width=True):
-                recompute_inventory_from_orders()
+                recompute_inventory_from_orders(state)
                 st.success("Inventory recomputed from orders!")
+
+        if st.button("🗄️ Archive Old Orders & Chat", key=f"{key_prefix}_archive",
+                     use_container_width=True):
+            report = archive_old_data()
+            state.chat = load_chat()
+            recompute_inventory_from_orders(state)
+            st.success(
+                f"Archived {report['orders_archived']} orders and "
+                f"{report['chat_archived']} messages. "
+                f"DB size {report['size_before'] / 1024:.0f} KB → "
+                f"{report['size_after'] / 1024:.0f} KB"
+            )
     else:
         st.markdown("""
         <div style="text-align: center; padding: 40px; background: white; border-radius: 10px; margin: 20px 0;">
@@ -475,7 +300,72 @@ def render_shopkeeper_dashboard(key_prefix: str = "shop_tab"):
             <p style="color: #999;">Orders will appear here once customers start placing them</p>
         </div>
         """, unsafe_allow_html=True)
-    
+
+    # History search (FTS5 over chat + order requests)
+    st.markdown("### 🔍 Search History")
+    search_query = st.text_input("Search", placeholder="e.g. chawal, doodh, दूध",
+                                 key=f"{key_prefix}_search", label_visibility="collapsed")
+    if search_query.strip():
+        results = search(search_query.strip())
+        if results:
+            for r in results:
+                if r['source'] == 'order':
+                    label = f"📋 Order #{r['id']} ({r['status']})"
+                else:
+                    label = f"💬 {r['role']}"
+                    if r['order_id']:
+                        label += f" · Order #{r['order_id']}"
+                ts = r['ts'][:16].replace('T', ' ')
+                st.markdown(search_result_html(label, ts, r['snippet']), unsafe_allow_html=True)
+        else:
+            st.info("No matching messages or orders.")
+
+    # Cross-store admin view (queries every store's database in parallel)
+    with st.expander(f"🏬 All Stores (current: {state.store_id})"):
+        if st.button("Load store summaries", key=f"{key_prefix}_all_stores"):
+            summaries = all_store_summaries()
+            st.dataframe([
+                {'Store': sid, 'Orders': s['orders'], 'Pending': s['pending'],
+                 'Revenue': f"₹{s['revenue']:.0f}", 'Messages': s['messages'],
+                 'DB KB': s['db_bytes'] // 1024}
+                for sid, s in summaries.items()
+            ], use_container_width=True)
+
+    # Shared model call governor (concurrency, rate limit, circuit breaker)
+    with st.expander("🤖 Model Governor"):
+        gm = get_governor().metrics()
+        g1, g2, g3, g4 = st.columns(4)
+        g1.metric("Breaker", gm['breaker'])
+        g2.metric("Active / Queued", f"{gm['active']} / {gm['queue_depth']}")
+        g3.metric("Queue wait p95", f"{gm['queue_wait_p95_ms']:.0f} ms")
+        g4.metric("Deduplicated", gm['deduplicated'])
+        st.caption(f"calls {gm['calls']} · completed {gm['completed']} · failed {gm['failed']} · "
+                   f"timeouts {gm['timeouts']} · rejected (breaker {gm['rejected_breaker']}, "
+                   f"queue {gm['rejected_queue']}, wait {gm['rejected_wait']})")
+
+    with st.expander("🐢 Database Profiler"):
+        top = query_stats(limit=15)
+        if top:
+            st.dataframe([
+                {'Statement': r['sql'], 'Calls': r['calls'], 'Total ms': f"{r['total_ms']:.1f}",
+                 'Avg ms': f"{r['avg_ms']:.2f}", 'Max ms': f"{r['max_ms']:.1f}", 'Rows': r['rows'],
+                 'Lock wait ms': f"{r['lock_wait_ms']:.1f}", 'Nested': r['nested']}
+                for r in top
+            ], use_container_width=True)
+        else:
+            st.caption("No statements recorded yet (set KIRANA_PROFILE_SQL=1 to enable profiling).")
+        slow = slow_queries(limit=10)
+        if slow:
+            st.markdown(f"**Slow queries (≥ {SLOW_QUERY_MS:.0f} ms)**")
+            st.dataframe([
+                {'When': s['ts'][:19], 'DB': s['db'], 'ms': s['ms'],
+                 'Lock wait ms': s['lock_wait_ms'], 'Rows': s['rows'], 'Statement': s['sql']}
+                for s in slow
+            ], use_container_width=True)
+        st.caption(f"Since {query_stats_since()[:19]} UTC")
+        if st.button("Reset profiler", key=f"{key_prefix}_reset_profiler"):
+            reset_query_stats()
+
     # API Status
     if not model:
         st.markdown("""
@@ -671,12 +561,8 @@ with tabs[0]:
     if not hasattr(state, 'msg_input_value'):
         state.msg_input_value = ''
 
-    # Chat messages container
-    for _msg in state.chat[-30:]:  # Show last 30 messages
-        if _msg['role'] == 'user':
-            st.markdown(f'<div style="display: flex; justify-content: flex-end; margin: 5px 0;"><div class="msg-bubble msg-user">{_msg["text"]}</div></div>', unsafe_allow_html=True)
-        else:
-            st.markdown(f'<div style="display: flex; justify-content: flex-start; margin: 5px 0;"><div class="msg-bubble msg-ai">{_msg["text"]}</div></div>', unsafe_allow_html=True)
+    # Chat messages container (last 30 messages, one element)
+    st.markdown(chat_html(state.chat, limit=30), unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
     
     # WhatsApp-style input bar
@@ -823,14 +709,25 @@ with tabs[0]:
     # Process send - only when user clicks send button
     if send_clicked and manual_text.strip():
         user_msg = manual_text.strip()
+        # Same input widget + same text => same key, so retries/double clicks replay
+        digest = hashlib.sha1(user_msg.encode('utf-8')).hexdigest()[:16]
+        msg_key = f"{state.client_id}:{state.voice_input_counter}:{digest}"
         with st.spinner("Thinking..."):
-            state.chat.append({"role":"user","text":user_msg})
-            save_chat('user', user_msg)
-            parsed = process_user_message(user_msg)
+            # Failed parses release their key, so the session remembers the saved utterance
+            saved_key, request_msg_id = state.get('saved_request', (None, None))
+            if saved_key != msg_key:
+                state.chat.append({"role":"user","text":user_msg})
+                request_msg_id = save_chat('user', user_msg)
+                state.saved_request = (msg_key, request_msg_id)
+            parsed = process_user_message(state, model, user_msg, idempotency_key=msg_key,
+                                          request_msg_id=request_msg_id)
             reply = parsed.get('response_text', '(No response)')
-            state.chat.append({"role":"assistant","text":reply})
-            save_chat('assistant', reply, parsed.get('order_id'))
-            speak(reply)
+            # A rerun can land between processing and saving the reply; the replay then saves it
+            if not parsed.get('__replayed') or not parsed.get('__reply_saved'):
+                state.chat.append({"role":"assistant","text":reply})
+                with transaction():
+                    record_reply(msg_key, save_chat('assistant', reply, parsed.get('order_id')))
+                speak(reply)
         # Clear input after send by resetting state and forcing widget recreation
         state.msg_input_value = ''
         state.voice_input_counter += 1
@@ -0,0 +1,372 @@
+"""Synthetic customer load test for agent.process_user_message and storage.
+
+N simulated customers (threads), each with its own session state, send mixed
+Hinglish/Hindi/English utterances through the same path as the app's send
+button (save user chat -> process_user_message with an idempotency key ->
+save assistant chat). Gemini is replaced by a stub with configurable latency
+that answers with the JSON shape the real prompt asks for.
+
+    python benchmarks/loadtest.py --customers 20 --turns 25 --latency-ms 300
+    python benchmarks/loadtest.py --replay traffic.jsonl --customers 8
+    python benchmarks/loadtest.py --customers 20 --turns 24 --batch 6   # one model call per burst
+    python benchmarks/loadtest.py --customers 20 --llm-rps 1000 --llm-burst 1000 \
+        --llm-concurrency 20
+
+--replay takes a file of utterances, one per line: plain text or JSON with a
+"text" field. Runs against a temporary database unless --db is given.
+Reports turns/sec, p50/p95/p99 turn latency, DB commit rate and checks for
+oversold stock and duplicate order ids (exit 1 with --check if any fail).
+
+Each customer is a separate app session checking stock against its own
+view, like two browser tabs, so oversell is checked per customer.
+
+Model calls go through the LLM governor. Its defaults (5 calls/s) cap
+throughput long before the database does. --llm-rps, --llm-burst and
+--llm-concurrency override them, and the limits used are printed with
+the results.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import governor  # noqa: E402
+import storage  # noqa: E402
+
+# ---------------- Synthetic traffic -----------------
+ITEM_WORDS = {
+    'milk': ['milk', 'doodh', 'दूध'],
+    'bread': ['bread', 'bread', 'ब्रेड'],
+    'rice': ['rice', 'chawal', 'चावल'],
+    'maggi': ['maggi', 'maggi', 'मैगी'],
+}
+QTY_WORDS = {
+    1: ['1', 'ek', 'एक'],
+    2: ['2', 'do', 'दो'],
+    3: ['3', 'teen', 'तीन'],
+    5: ['5', 'paanch', 'पांच'],
+}
+ORDER_TEMPLATES = [
+    ('en', "please send {q} {i}"),
+    ('en', "I want {q} {i} and {q2} {i2}"),
+    ('hinglish', "bhaiya {q} {i} bhej do"),
+    ('hinglish', "{q} packet {i} chahiye"),
+    ('hi', "मुझे {q} {i} चाहिए"),
+    ('hi', "{q} {i} और {q2} {i2} भेज दीजिए"),
+]
+OTHER_UTTERANCES = [
+    ('greeting', "namaste bhaiya"), ('greeting', "hello"), ('greeting', "नमस्ते"),
+    ('status', "mera order kahan hai?"), ('status', "where is my order"),
+    ('status', "मेरा ऑर्डर कब आएगा"),
+    ('inventory_check', "doodh hai kya?"), ('inventory_check', "is rice available"),
+    ('inventory_check', "चावल है?"),
+]
+LANG_COL = {'en': 0, 'hinglish': 1, 'hi': 2}
+
+
+def synthetic_utterance(rng: random.Random) -> str:
+    if rng.random() < 0.6:
+        lang, tpl = rng.choice(ORDER_TEMPLATES)
+        col = LANG_COL[lang]
+        i, i2 = rng.sample(list(ITEM_WORDS), 2)
+        q, q2 = rng.choice(list(QTY_WORDS)), rng.choice(list(QTY_WORDS))
+        return tpl.format(q=QTY_WORDS[q][col], i=ITEM_WORDS[i][col],
+                          q2=QTY_WORDS[q2][col], i2=ITEM_WORDS[i2][col])
+    return rng.choice(OTHER_UTTERANCES)[1]
+
+
+def load_replay(path: str):
+    utterances = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                try:
+                    line = json.loads(line).get('text') or ''
+                except ValueError:
+                    pass
+            if line:
+                utterances.append(line)
+    return utterances
+
+
+# ---------------- Stub model -----------------
+_WORD_TO_ITEM = {w.lower(): name for name, words in ITEM_WORDS.items() for w in words}
+_WORD_TO_QTY = {w: q for q, words in QTY_WORDS.items() for w in words}
+
+
+class StubModel:
+    """Stands in for genai.GenerativeModel: sleeps, then answers like the real prompt asks."""
+
+    def __init__(self, latency_ms: float, jitter_ms: float, seed: int = 0):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt: str):
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self._rng.gauss(self.latency, self.jitter))
+        time.sleep(delay)
+        batch = re.search(r'MESSAGES: (\[.*\])\s*$', prompt, re.S)
+        if batch:
+            answers = [dict(self._parse(m['text']), id=m['id']) for m in json.loads(batch.group(1))]
+            return types.SimpleNamespace(text=json.dumps(answers, ensure_ascii=False))
+        m = re.search(r'USER_MESSAGE: "(.*)"\s*$', prompt, re.S)
+        if not m:  # clarification / apology prompt
+            return types.SimpleNamespace(text="Sorry, that item is not available right now.")
+        return types.SimpleNamespace(text=json.dumps(self._parse(m.group(1)), ensure_ascii=False))
+
+    @staticmethod
+    def _parse(text: str) -> dict:
+        tokens = re.findall(r'[\wऀ-ॿ]+', text.lower())
+        items, qty = [], 1
+        for tok in tokens:
+            if tok in _WORD_TO_QTY:
+                qty = _WORD_TO_QTY[tok]
+            elif tok in _WORD_TO_ITEM:
+                items.append({'name': _WORD_TO_ITEM[tok], 'qty': qty})
+                qty = 1
+        if items and not re.search(r'hai\b|available|है\?', text):
+            return {'intent': 'order', 'items': items,
+                    'response_text': "Theek hai, order confirm. 30 min mein delivery."}
+        if re.search(r'order|ऑर्डर', text):
+            return {'intent': 'status', 'items': [],
+                    'response_text': "Aapka order raaste mein hai."}
+        if items:
+            return {'intent': 'inventory_check', 'items': [],
+                    'response_text': "Haan, available hai."}
+        return {'intent': 'greeting', 'items': [], 'response_text': "Namaste! Kya chahiye?"}
+
+
+# ---------------- Commit counting -----------------
+_COMMITTING = ('save_chat', 'save_order', 'update_order_status', 'claim_message',
+               'complete_message', 'release_message', 'lease_id_block', 'transaction')
+
+
+def count_commits(modules):
+    """Wrap every storage function that commits, in each module that imported it."""
+    counter = {'n': 0}
+    lock = threading.Lock()
+
+    def wrap(fn):
+        def wrapper(*args, **kwargs):
+            in_tx = storage._current_tx.get() is not None  # commits once, when the transaction ends
+            result = fn(*args, **kwargs)
+            if not in_tx:
+                with lock:
+                    counter['n'] += 1
+            return result
+        return wrapper
+
+    for name in _COMMITTING:
+        original = getattr(storage, name)
+        wrapped = wrap(original)
+        for mod in modules:
+            if getattr(mod, name, None) is original:
+                setattr(mod, name, wrapped)
+    return counter
+
+
+# ---------------- Simulation -----------------
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+class Tally:
+    """Results shared by all customer threads."""
+
+    def __init__(self):
+        self.latencies, self.errors, self.order_ids = [], [], []
+        self.lock = threading.Lock()
+
+    def error(self, e: Exception):
+        with self.lock:
+            self.errors.append(f"{type(e).__name__}: {e}")
+
+    def turns(self, cid, elapsed: float, results):
+        with self.lock:
+            self.latencies.extend([elapsed] * len(results))
+            self.order_ids.extend((cid, p['order_id']) for p in results if p.get('order_id'))
+
+
+def run_customer(cid, agent, model, utterances, turns, rng, tally: Tally, batch_size=1):
+    state = types.SimpleNamespace(store_id=storage.DEFAULT_STORE, orders=[], inventory=None,
+                                  chat=[])
+    agent.recompute_inventory_from_orders(state)
+    if batch_size > 1:
+        return run_customer_batched(cid, agent, model, utterances, turns, rng, tally, state,
+                                    batch_size)
+    for turn in range(turns):
+        text = next_utterance(utterances, cid, turns, turn, rng)
+        started = time.perf_counter()
+        try:
+            msg_id = storage.save_chat('user', text)
+            parsed = agent.process_user_message(state, model, text,
+                                                idempotency_key=f"load:{cid}:{turn}",
+                                                request_msg_id=msg_id)
+            storage.save_chat('assistant', parsed.get('response_text', ''), parsed.get('order_id'))
+        except Exception as e:  # collisions surface here as IntegrityError
+            tally.error(e)
+            continue
+        tally.turns(cid, time.perf_counter() - started, [parsed])
+
+
+def run_customer_batched(cid, agent, model, utterances, turns, rng, tally: Tally, state,
+                         batch_size):
+    """Same traffic, but turns arrive in bursts of batch_size via process_user_messages."""
+    for first in range(0, turns, batch_size):
+        started = time.perf_counter()
+        batch = []
+        for turn in range(first, min(turns, first + batch_size)):
+            text = next_utterance(utterances, cid, turns, turn, rng)
+            batch.append({'id': turn, 'text': text, 'idempotency_key': f"load:{cid}:{turn}"})
+        try:
+            for msg in batch:
+                msg['request_msg_id'] = storage.save_chat('user', msg['text'])
+            results = agent.process_user_messages(state, model, batch)
+            for msg in batch:
+                parsed = results[msg['id']]
+                storage.save_chat('assistant', parsed.get('response_text', ''),
+                                  parsed.get('order_id'))
+        except Exception as e:
+            tally.error(e)
+            continue
+        # Every message in the burst waited for the whole burst
+        tally.turns(cid, time.perf_counter() - started, list(results.values()))
+
+
+def next_utterance(utterances, cid, turns, turn, rng) -> str:
+    if utterances:
+        return utterances[(cid * turns + turn) % len(utterances)]
+    return synthetic_utterance(rng)
+
+
+def check_integrity(agent, order_ids):
+    """order_ids: (customer, order id) pairs returned by the run."""
+    problems = []
+    ids = [oid for _, oid in order_ids]
+    by_customer = {}
+    for cid, oid in order_ids:
+        by_customer.setdefault(cid, []).append(oid)
+    with storage.get_connection() as conn:
+        n, distinct = conn.execute("SELECT COUNT(*), COUNT(DISTINCT id) FROM orders").fetchone()
+        sold = {}
+        for cid, oids in by_customer.items():
+            marks = ','.join('?' * len(oids))
+            sold[cid] = conn.execute(
+                f"SELECT item_name, SUM(qty) FROM order_items WHERE order_id IN ({marks}) "
+                "GROUP BY item_name", oids
+            ).fetchall()
+    if len(ids) != len(set(ids)):
+        problems.append(f"duplicate order ids returned: {len(ids) - len(set(ids))}")
+    if n != distinct:
+        problems.append(f"duplicate order ids stored: {n - distinct}")
+    stock = agent.store_inventory(storage.DEFAULT_STORE)
+    for cid in sorted(sold):
+        for name, qty in sorted(sold[cid]):
+            opening = stock.get(name, {}).get('qty', 0)
+            if qty > opening:
+                problems.append(f"customer {cid} oversold {name}: {qty} sold vs {opening} in stock")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load test process_user_message with simulated customers.")
+    parser.add_argument('--customers', type=int, default=10)
+    parser.add_argument('--turns', type=int, default=20, help="messages per customer")
+    parser.add_argument('--latency-ms', type=float, default=250.0, help="stub model mean latency")
+    parser.add_argument('--jitter-ms', type=float, default=50.0)
+    parser.add_argument('--replay', help="file of recorded utterances (text or JSONL with 'text')")
+    parser.add_argument('--db', help="copy this database instead of starting empty")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch', type=int, default=1,
+                        help="send each customer's turns in bursts of this size "
+                             "via process_user_messages")
+    parser.add_argument('--llm-rps', type=float, default=governor.RATE_PER_SECOND,
+                        help="governor token bucket rate (model calls/s)")
+    parser.add_argument('--llm-burst', type=int, default=governor.BURST,
+                        help="governor token bucket size")
+    parser.add_argument('--llm-concurrency', type=int, default=governor.MAX_CONCURRENCY,
+                        help="model calls in flight at once")
+    parser.add_argument('--check', action='store_true', help="exit 1 if integrity checks fail")
+    args = parser.parse_args(argv)
+
+    tmp_dir = tempfile.mkdtemp(prefix='kirana_load_')
+    storage.DB_PATH = os.path.join(tmp_dir, 'data.db')
+    storage.STORES_DIR = tmp_dir
+    if args.db:
+        shutil.copy(args.db, storage.DB_PATH)
+    try:
+        storage.init_db()
+        import agent
+        commits = count_commits([storage, agent, sys.modules[__name__]])
+        model = StubModel(args.latency_ms, args.jitter_ms, args.seed)
+        governor._governor = governor.ModelGovernor(max_concurrency=args.llm_concurrency,
+                                                    rate=args.llm_rps, burst=args.llm_burst)
+        utterances = load_replay(args.replay) if args.replay else None
+
+        tally = Tally()
+        threads = [
+            threading.Thread(target=run_customer, name=f"customer-{cid}",
+                             args=(cid, agent, model, utterances, args.turns,
+                                   random.Random(args.seed + cid), tally, args.batch))
+            for cid in range(args.customers)
+        ]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - started
+
+        latencies, errors, order_ids = sorted(tally.latencies), tally.errors, tally.order_ids
+        turns = len(latencies)
+        print(f"customers={args.customers} turns={turns} errors={len(errors)} "
+              f"model_calls={model.calls} wall={wall:.2f}s")
+        print(f"throughput:   {turns / wall:8.1f} turns/s")
+        print(f"latency p50:  {percentile(latencies, 50) * 1000:8.1f} ms")
+        print(f"latency p95:  {percentile(latencies, 95) * 1000:8.1f} ms")
+        print(f"latency p99:  {percentile(latencies, 99) * 1000:8.1f} ms")
+        if latencies:
+            print(f"latency mean: {statistics.mean(latencies) * 1000:8.1f} ms")
+        print(f"db commits:   {commits['n']} ({commits['n'] / wall:.1f}/s), "
+              f"orders created: {len(order_ids)}")
+        gov = governor.get_governor().metrics()
+        print(f"governor:     rps={args.llm_rps:g} burst={args.llm_burst} "
+              f"concurrency={args.llm_concurrency}, "
+              f"queue wait p95 {gov['queue_wait_p95_ms']:.1f} ms, rejected "
+              f"{gov['rejected_breaker'] + gov['rejected_queue'] + gov['rejected_wait']}")
+        for err in errors[:5]:
+            print(f"error: {err}")
+        problems = check_integrity(agent, order_ids)
+        for p in problems:
+            print(f"CHECK FAILED: {p}")
+        if not problems:
+            print("checks: no oversell, no id collisions")
+        return 1 if (args.check and (problems or errors)) else 0
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""Micro-benchmarks for storage and parsing hot paths, with regression thresholds.
+
+Each dataset size gets a fresh temporary database seeded with that many orders
+(with order_items) and chat messages; 100 orders stay active, the rest are
+delivered. Every benchmark reports the fastest of --repeat runs in seconds per
+operation; the minimum is the run least disturbed by the rest of the machine.
+
+    python benchmarks/microbench.py --sizes 1000,100000 --save-baseline
+    python benchmarks/microbench.py --sizes 1000,100000            # compare
+
+Results are compared against benchmarks/baseline.json (or --baseline) and the
+run exits 1 if any benchmark is slower than baseline * (1 + its threshold).
+Writes that wait on fsync vary far more between runs than CPU-bound code, so
+they get a looser threshold (THRESHOLDS); --threshold sets one for all.
+Baselines are machine specific and not committed: record one with
+--save-baseline on the machine you compare on.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import agent  # noqa: E402
+import resolver  # noqa: E402
+import storage  # noqa: E402
+
+DEFAULT_SIZES = '1000,100000,1000000'
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+ACTIVE_ORDERS = 100
+DEFAULT_THRESHOLD = 0.25
+# Allowed slowdown for benchmarks dominated by commit/fsync latency
+THRESHOLDS = {'save_chat': 1.0, 'save_order': 1.0, '_persist_order': 1.0}
+SEED_BATCH = 20000
+
+FENCED_REPLY = '```json\n' + json.dumps({
+    "intent": "order",
+    "items": [{"name": "milk", "qty": 2}, {"name": "rice", "qty": 1}],
+    "response_text": "Theek hai! 2 packet doodh aur 1 kilo chawal, total ₹130. "
+                     "30 minute mein delivery.",
+}, ensure_ascii=False) + '\n```'
+
+
+# ---------------- Dataset -----------------
+def seed(size: int):
+    names = list(agent.INVENTORY)
+    start = datetime.utcnow() - timedelta(minutes=size)
+    with storage.get_connection() as conn:
+        for lo in range(1, size + 1, SEED_BATCH):
+            hi = min(size, lo + SEED_BATCH - 1)
+            orders, lines, chats = [], [], []
+            for oid in range(lo, hi + 1):
+                name = names[oid % len(names)]
+                price = agent.INVENTORY[name]['price']
+                items = [{"name": name, "qty": 1, "unit_price": price, "line_total": price}]
+                ts = (start + timedelta(minutes=oid)).isoformat()
+                status = 'processing' if oid > size - ACTIVE_ORDERS else 'delivered'
+                orders.append((oid, ts, status, price, json.dumps(items), f"1 {name} bhej do",
+                               "Order confirmed."))
+                lines.append((oid, name, 1, price, price))
+                chats.append((ts, 'user', f"1 {name} bhej do", None))
+            conn.executemany(
+                "INSERT INTO orders (id, created_at, status, total_amount, items_json, "
+                "raw_request, response_text) VALUES (?,?,?,?,?,?,?)", orders)
+            conn.executemany(
+                "INSERT INTO order_items (order_id, item_name, qty, unit_price, line_total) "
+                "VALUES (?,?,?,?,?)", lines)
+            conn.executemany(
+                "INSERT INTO chat_messages (ts, role, text, order_id) VALUES (?,?,?,?)", chats)
+            conn.commit()
+    storage._seed_sequence('orders', size + 1)
+
+
+def new_state():
+    state = types.SimpleNamespace(store_id=storage.DEFAULT_STORE, orders=storage.load_orders(),
+                                  inventory=None)
+    agent.recompute_inventory_from_orders(state)
+    return state
+
+
+# ---------------- Benchmarks -----------------
+# Each returns (callable, ops_per_call, reset_or_None)
+def bench_save_chat(state):
+    def run():
+        for _ in range(50):
+            storage.save_chat('user', "2 packet doodh aur ek bread bhej do")
+    return run, 50, None
+
+
+def bench_save_order(state):
+    items = [{"name": "milk", "qty": 2, "unit_price": 25.0, "line_total": 50.0}]
+
+    def run():
+        for _ in range(50):
+            storage.save_order(storage.allocate_order_id(), 'processing', items, "2 doodh", "ok",
+                               50.0)
+    return run, 50, None
+
+
+def bench_persist_order(state):
+    items = [{"name": "milk", "qty": 2, "unit_price": 25.0, "line_total": 50.0}]
+
+    def run():
+        for _ in range(50):
+            storage._persist_order({"id": storage.allocate_order_id(),
+                                    "created_at": datetime.utcnow().isoformat(),
+                                    "status": 'processing', "total_amount": 50.0, "items": items})
+    return run, 50, None
+
+
+def bench_load_orders(state):
+    return storage.load_orders, 1, None
+
+
+def bench_load_chat(state):
+    return storage.load_chat, 1, None
+
+
+def bench_update_statuses(state):
+    active = [o for o in state.orders if o['status'] != 'delivered']
+
+    def reset():
+        for o in active:
+            o['status'] = 'processing'
+    return (lambda: agent.update_statuses(state)), 1, reset
+
+
+def bench_recompute_inventory(state):
+    return (lambda: agent.recompute_inventory_from_orders(state)), 1, None
+
+
+def bench_extract_json_block(state):
+    return (lambda: [agent.extract_json_block(FENCED_REPLY) for _ in range(1000)]), 1000, None
+
+
+def bench_resolve_item_name(state):
+    catalog = agent.inventory_for(state)
+    names = ["doodh packet", "Maggi noodles", "chaawal", "दूध", "ब्रेड का पैकेट", "paneer"]
+    index = resolver.index_for(catalog)
+    # Uncached path: measures the index itself, not the per-name memo
+    return (lambda: [index._resolve(n) for n in names * 100]), len(names) * 100, None
+
+
+def bench_build_prompt(state):
+    text = "bhaiya 2 packet doodh aur ek kilo chawal bhej do"
+    return (lambda: agent.build_prompt(state, text)), 1, None
+
+
+BENCHMARKS = {
+    'save_chat': bench_save_chat,
+    'save_order': bench_save_order,
+    '_persist_order': bench_persist_order,
+    'load_orders': bench_load_orders,
+    'load_chat': bench_load_chat,
+    'update_statuses': bench_update_statuses,
+    'recompute_inventory_from_orders': bench_recompute_inventory,
+    'extract_json_block': bench_extract_json_block,
+    'resolve_item_name': bench_resolve_item_name,
+    'build_prompt': bench_build_prompt,
+}
+
+
+def measure(fn, ops, reset, repeat):
+    samples = []
+    for _ in range(repeat):
+        if reset:
+            reset()
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) / ops)
+    return min(samples)
+
+
+def run_size(size: int, repeat: int, only) -> dict:
+    tmp_dir = tempfile.mkdtemp(prefix='kirana_bench_')
+    storage.DB_PATH = os.path.join(tmp_dir, 'data.db')
+    storage.STORES_DIR = tmp_dir
+    try:
+        storage.init_db()
+        t = time.perf_counter()
+        seed(size)
+        print(f"[{size}] seeded in {time.perf_counter() - t:.1f}s", flush=True)
+        state = new_state()
+        results = {}
+        for name, factory in BENCHMARKS.items():
+            if only and name not in only:
+                continue
+            fn, ops, reset = factory(state)
+            results[f"{name}@{size}"] = secs = measure(fn, ops, reset, repeat)
+            print(f"[{size}] {name:34s} {secs * 1e6:12.1f} us/op", flush=True)
+        return results
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def compare(results: dict, baseline: dict, threshold: float = None):
+    regressions = []
+    for key, secs in sorted(results.items()):
+        base = baseline.get(key)
+        if not base:
+            continue
+        if threshold is None:
+            limit = THRESHOLDS.get(key.split('@')[0], DEFAULT_THRESHOLD)
+        else:
+            limit = threshold
+        change = secs / base - 1.0
+        flag = 'REGRESSION' if change > limit else ''
+        print(f"{key:44s} {base * 1e6:12.1f} -> {secs * 1e6:12.1f} us/op  "
+              f"{change:+7.1%} (max {limit:+.0%}) {flag}")
+        if change > limit:
+            regressions.append(key)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Storage/parsing micro-benchmarks with regression thresholds.")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="comma-separated order counts")
+    parser.add_argument('--repeat', type=int, default=15,
+                        help="runs per benchmark; the fastest counts")
+    parser.add_argument('--only', help="comma-separated benchmark names")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="write results as the new baseline")
+    parser.add_argument('--threshold', type=float,
+                        help="allowed slowdown for every benchmark, 0.25 = 25%%; "
+                             "default per benchmark")
+    parser.add_argument('--output', help="also write this run's results to a JSON file")
+    args = parser.parse_args(argv)
+
+    only = set(args.only.split(',')) if args.only else None
+    results = {}
+    for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+        results.update(run_size(size, args.repeat, only))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"baseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --save-baseline first")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) slower than baseline by more than their threshold")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
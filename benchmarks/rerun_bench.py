@@ -0,0 +1,102 @@
+"""Startup vs per-rerun cost of app.py.
+
+Runs the app headlessly with Streamlit's AppTest, once cold and then N reruns
+in the same process, and prints wall time for each phase. One message is sent
+between the two so the send/rerun path runs too. Heavy objects (the
+compiled LangGraph, the Gemini client, .env loading, gtts/langgraph imports)
+should only show up in the cold run.
+
+For a before/after comparison reruns are timed two ways, interleaved: as the
+app runs now ("cached"), and with the caches cleared and .env, the graph and
+the Gemini client rebuilt inside the timed rerun, which is what every rerun
+paid when app.py built them itself ("rebuilt").
+
+    python benchmarks/rerun_bench.py --reruns 20
+
+Uses a temporary copy of the database so data.db is never touched.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def rebuild_process_objects():
+    """What every rerun used to do at the top of app.py: re-read .env and recompile the graph."""
+    import streamlit as st
+    from dotenv import load_dotenv
+
+    import agent
+    st.cache_resource.clear()
+    agent.get_graph.cache_clear()
+    agent._models.clear()
+    load_dotenv()
+    agent.get_graph()
+    agent.get_model(os.getenv('GOOGLE_API_KEY'))
+
+
+def time_reruns(at, n):
+    """(cached, rebuilt) rerun times, interleaved so drift affects both alike."""
+    cached, rebuilt = [], []
+    for _ in range(n):
+        for samples, before in ((cached, None), (rebuilt, rebuild_process_objects)):
+            t = time.perf_counter()
+            if before:
+                before()
+            at.run()
+            samples.append(time.perf_counter() - t)
+    return sorted(cached), sorted(rebuilt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reruns', type=int, default=20)
+    args = parser.parse_args()
+
+    from streamlit.testing.v1 import AppTest
+
+    import storage
+
+    tmp_dir = tempfile.mkdtemp(prefix='kirana_bench_')
+    storage.DB_PATH = os.path.join(tmp_dir, 'data.db')
+    if os.path.exists(os.path.join(ROOT, 'data.db')):
+        shutil.copy(os.path.join(ROOT, 'data.db'), storage.DB_PATH)
+
+    try:
+        t0 = time.perf_counter()
+        import agent  # noqa: F401  (module import is part of cold start)
+        at = AppTest.from_file(os.path.join(ROOT, 'app.py'), default_timeout=60)
+        at.run()
+        cold = time.perf_counter() - t0
+
+        # One send exercises the message path and its force_rerun()
+        t = time.perf_counter()
+        at.text_input[0].input("namaste").run()
+        at.button(key="send_btn").click().run()
+        send = time.perf_counter() - t
+        if at.exception:
+            print(f"send raised: {at.exception}")
+
+        cached, rebuilt = time_reruns(at, args.reruns)
+
+        print(f"cold start:      {cold * 1000:8.1f} ms")
+        print(f"send + rerun:    {send * 1000:8.1f} ms")
+        print(f"{'':17s}{'cached':>10s}{'rebuilt':>10s}")
+        for label, fn in (('mean', statistics.mean), ('median', statistics.median),
+                          ('p95', lambda s: s[int(len(s) * 0.95) - 1])):
+            print(f"rerun {label + ':':11s}{fn(cached) * 1000:10.1f}{fn(rebuilt) * 1000:10.1f} ms")
+        print(f"speedup (median): {statistics.median(rebuilt) / statistics.median(cached):.1f}x")
+        if at.exception:
+            print(f"app raised: {at.exception}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Database size for a synthetic month of traffic under each text storage layout.
+
+Every turn goes through the storage API the app uses: save the user message,
+claim/complete its idempotency key, save the order (for order turns) and save
+the assistant reply. Layouts:
+
+    copy        orders keep their own copy of request and reply text (previous layout)
+    reference   orders point at the chat messages holding the text
+    compressed  reference + KIRANA_COMPRESS_TEXT (zlib with a preset dictionary)
+
+    python benchmarks/sizebench.py --days 30 --turns-per-day 300
+
+Sizes are measured after a full VACUUM so free pages don't count.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import agent  # noqa: E402
+import storage  # noqa: E402
+
+LAYOUTS = ('copy', 'reference', 'compressed')
+ORDER_SHARE = 0.6
+
+REQUESTS = [
+    "bhaiya {q} packet {i} aur {q2} {i2} bhej do, ghar pe koi nahi hai toh gate pe rakh dena",
+    "please send {q} {i} and {q2} {i2} to my home as soon as possible, thank you",
+    "मुझे {q} {i} और {q2} {i2} चाहिए, जल्दी भेज दीजिए",
+    "{q} {i} chahiye aur {q2} {i2} bhi, kitna total hoga?",
+]
+OTHER = ["namaste bhaiya", "mera order kahan hai?", "doodh hai kya?", "where is my order",
+         "चावल है?"]
+REPLIES = [
+    "Theek hai! Aapka order confirm ho gaya hai: {q} {i} aur {q2} {i2}. Total ₹{total}. "
+    "Delivery 30 minute mein ho jayegi. Koi aur cheez chahiye toh bata dijiye. Dhanyavaad!",
+    "Order confirmed: {q} {i} and {q2} {i2}. Your total is ₹{total}. "
+    "Your order will be delivered in 30 minutes. Thank you for shopping with us!",
+    "आपका ऑर्डर कन्फर्म हो गया है: {q} {i} और {q2} {i2}। कुल ₹{total}। "
+    "डिलीवरी 30 मिनट में हो जाएगी। धन्यवाद!",
+]
+OTHER_REPLIES = ["Namaste! Kya chahiye?",
+                 "Aapka order raaste mein hai, 10 minute mein pahunch jayega.",
+                 "Haan, available hai. Kitna chahiye?"]
+
+
+def simulate(layout: str, turns: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    names = list(agent.INVENTORY)
+    orders = 0
+    for turn in range(turns):
+        key = f"size:{turn}"
+        storage.claim_message(key)
+        if rng.random() < ORDER_SHARE:
+            i, i2 = rng.sample(names, 2)
+            q, q2 = rng.randint(1, 5), rng.randint(1, 5)
+            total = q * agent.INVENTORY[i]['price'] + q2 * agent.INVENTORY[i2]['price']
+            fields = dict(q=q, i=i, q2=q2, i2=i2, total=f"{total:.0f}")
+            text = rng.choice(REQUESTS).format(**fields)
+            reply = rng.choice(REPLIES).format(**fields)
+            msg_id = storage.save_chat('user', text)
+            oid = storage.allocate_order_id()
+            items = [{"name": i, "qty": q, "unit_price": agent.INVENTORY[i]['price'],
+                      "line_total": q * agent.INVENTORY[i]['price']},
+                     {"name": i2, "qty": q2, "unit_price": agent.INVENTORY[i2]['price'],
+                      "line_total": q2 * agent.INVENTORY[i2]['price']}]
+            storage.save_order(oid, 'delivered', items, text, reply, total,
+                               None if layout == 'copy' else msg_id)
+            # The copy layout stored the reply on the order and never linked the chat row
+            storage.save_chat('assistant', reply, None if layout == 'copy' else oid)
+            parsed = {"intent": "order", "items": [{"name": i, "qty": q}, {"name": i2, "qty": q2}],
+                      "response_text": reply, "order_id": oid}
+            orders += 1
+        else:
+            text, reply = rng.choice(OTHER), rng.choice(OTHER_REPLIES)
+            storage.save_chat('user', text)
+            storage.save_chat('assistant', reply)
+            parsed = {"intent": "unknown", "items": [], "response_text": reply}
+        storage.complete_message(key, parsed, parsed.get('order_id'))
+    return {"orders": orders}
+
+
+def measure(layout: str, turns: int, seed: int) -> dict:
+    tmp_dir = tempfile.mkdtemp(prefix='kirana_size_')
+    storage.DB_PATH = os.path.join(tmp_dir, 'data.db')
+    storage.STORES_DIR = tmp_dir
+    try:
+        # Before init_db(): the FTS layout depends on whether text is compressed
+        storage.COMPRESS_TEXT = layout == 'compressed'
+        storage.init_db()
+        started = time.perf_counter()
+        info = simulate(layout, turns, seed)
+        elapsed = time.perf_counter() - started
+        for pool in list(storage._pools.values()):
+            pool.close()
+        conn = storage._connect(storage.DB_PATH)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        size = storage.db_size()
+        return {"layout": layout, "turns": turns, "orders": info['orders'], "bytes": size,
+                "bytes_per_turn": size / turns, "seconds": elapsed}
+    finally:
+        storage._pools.clear()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database size per text storage layout.")
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--turns-per-day', type=int, default=300)
+    parser.add_argument('--layouts', default=','.join(LAYOUTS))
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help="write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    turns = args.days * args.turns_per_day
+    results = []
+    for layout in args.layouts.split(','):
+        r = measure(layout, turns, args.seed)
+        results.append(r)
+        print(f"{layout:11s} {r['bytes'] / 1024:10.0f} KB  {r['bytes_per_turn']:7.0f} B/turn  "
+              f"({r['orders']} orders, written in {r['seconds']:.1f}s)", flush=True)
+    base = results[0]['bytes']
+    for r in results[1:]:
+        print(f"{r['layout']} vs {results[0]['layout']}: {r['bytes'] / base - 1:+.1%}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import heapq
+import math
+from array import array
+from collections.abc import Mapping
+
+from resolver import FUZZY_MIN_LEN, _trigrams, edit_distance, tokens
+
+# Store catalog held column-wise: one list of SKU names plus typed arrays for
+# price / opening qty / unit / low-stock level, so tens of thousands of SKUs
+# cost a few bytes per field instead of a dict per item. An inverted index
+# over normalized name and alias tokens (same folding as resolver.py) picks
+# the SKUs relevant to an utterance.
+#
+# Catalog is a read-only Mapping of sku -> {'qty', 'unit', 'price', ...}, so
+# code written against the plain INVENTORY dict keeps working; the per-item
+# dict is built on access.
+
+_NO_THRESHOLD = -1
+
+class Catalog(Mapping):
+    def __init__(self, items: dict):
+        self.names = list(items)
+        self._pos = {name: i for i, name in enumerate(self.names)}
+        self.units = []
+        unit_idx = {}
+        self.prices = array('d')
+        self.qtys = array('l')
+        self.unit_ids = array('H')
+        self.low_stock = array('l')
+        self._aliases = {}   # sparse: position -> {'hindi': [...], 'aliases': [...]}
+        postings = {}
+        for i, (name, info) in enumerate(items.items()):
+            unit = info.get('unit', '')
+            if unit not in unit_idx:
+                unit_idx[unit] = len(self.units)
+                self.units.append(unit)
+            self.unit_ids.append(unit_idx[unit])
+            self.prices.append(float(info.get('price', 0.0)))
+            self.qtys.append(int(info.get('qty', 0)))
+            self.low_stock.append(int(info['low_stock']) if 'low_stock' in info else _NO_THRESHOLD)
+            extra = {k: list(info[k]) for k in ('hindi', 'aliases') if info.get(k)}
+            if extra:
+                self._aliases[i] = extra
+            for alias in [name] + extra.get('hindi', []) + extra.get('aliases', []):
+                for term in tokens(alias):
+                    plist = postings.setdefault(term, array('l'))
+                    if not plist or plist[-1] != i:
+                        plist.append(i)
+        self._postings = postings
+        n = max(1, len(self.names))
+        self._idf = {term: math.log(1 + n / len(plist)) for term, plist in postings.items()}
+        self._vocab_grams = None
+
+    @classmethod
+    def from_dict(cls, items: dict) -> 'Catalog':
+        return items if isinstance(items, cls) else cls(items)
+
+    # ---------------- Mapping -----------------
+    def __getitem__(self, name: str) -> dict:
+        i = self._pos[name]
+        info = {'qty': self.qtys[i], 'unit': self.units[self.unit_ids[i]], 'price': self.prices[i]}
+        if self.low_stock[i] != _NO_THRESHOLD:
+            info['low_stock'] = self.low_stock[i]
+        info.update(self._aliases.get(i, {}))
+        return info
+
+    def __contains__(self, name) -> bool:
+        return name in self._pos
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def opening_stock(self) -> dict:
+        return dict(zip(self.names, self.qtys))
+
+    # ---------------- Retrieval -----------------
+    def _correct(self, term: str):
+        """Closest indexed term for a misspelt one ("sunflowr", "chawl"), or None.
+
+        Matches against the term vocabulary, which stays small however many SKUs there are.
+        """
+        if len(term) < FUZZY_MIN_LEN:
+            return None
+        if self._vocab_grams is None:
+            grams = {}
+            for t in self._postings:
+                for g in _trigrams(t):
+                    grams.setdefault(g, []).append(t)
+            self._vocab_grams = grams
+        counts = {}
+        for g in _trigrams(term):
+            for cand in self._vocab_grams.get(g, ()):
+                counts[cand] = counts.get(cand, 0) + 1
+        limit = max(1, len(term) // 4)
+        best, best_dist = None, limit + 1
+        for cand, _ in heapq.nlargest(20, counts.items(), key=lambda kv: kv[1]):
+            d = edit_distance(term, cand, limit)
+            if d < best_dist:
+                best, best_dist = cand, d
+        return best
+
+    def search(self, text: str, k: int = 20):
+        """Up to k SKU names most relevant to text, best first (idf-weighted term overlap)."""
+        scores = {}
+        for term in set(tokens(text)):
+            plist = self._postings.get(term)
+            weight = self._idf.get(term, 0.0)
+            if plist is None:
+                corrected = self._correct(term)
+                if corrected is None:
+                    continue
+                plist, weight = self._postings[corrected], 0.8 * self._idf[corrected]
+            for i in plist:
+                scores[i] = scores.get(i, 0.0) + weight
+        best = heapq.nsmallest(k, scores.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [self.names[i] for i, _ in best]
@@ -0,0 +1,117 @@
+"""Bulk export/import of orders, order_items, chat_messages, their archives and rollups.
+
+    python datatools.py export --out backup/ --format jsonl [--store default]
+    python datatools.py import --src backup/ --format jsonl [--store default] [--skip-existing]
+
+Rows stream through storage.iter_table()/import_rows() in fixed-size batches,
+so memory use stays flat regardless of table size. One file per table
+(<table>.csv or <table>.jsonl). CSV writes NULL as \\N.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import storage
+
+FORMATS = ('csv', 'jsonl')
+CSV_NULL = '\\N'
+
+
+def _write_table(table: str, path: str, fmt: str, batch_size: int) -> int:
+    cols = storage.EXPORT_TABLES[table]
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(cols)
+            for rows in storage.iter_table(table, batch_size):
+                writer.writerows([[CSV_NULL if v is None else v for v in row] for row in rows])
+                count += len(rows)
+        else:
+            for rows in storage.iter_table(table, batch_size):
+                f.write(''.join(json.dumps(dict(zip(cols, row)), ensure_ascii=False) + '\n'
+                                for row in rows))
+                count += len(rows)
+    return count
+
+
+def _read_batches(table: str, path: str, fmt: str, batch_size: int):
+    cols = storage.EXPORT_TABLES[table]
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            reader = csv.reader(f)
+            header = next(reader, None)
+            # Older exports lack the trailing columns added since; those import as NULL
+            if not header or header != cols[:len(header)]:
+                raise ValueError(f"{path}: expected columns {cols}, got {header}")
+            missing = [None] * (len(cols) - len(header))
+            rows_iter = ([None if v == CSV_NULL else v for v in row] + missing for row in reader)
+        else:
+            rows_iter = (tuple(json.loads(line).get(c) for c in cols) for line in f if line.strip())
+        batch = []
+        for row in rows_iter:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def export_data(out_dir: str, fmt: str = 'jsonl',
+                batch_size: int = storage.EXPORT_BATCH_SIZE) -> dict:
+    os.makedirs(out_dir, exist_ok=True)
+    counts = {}
+    for table in storage.EXPORT_TABLES:
+        path = os.path.join(out_dir, f"{table}.{fmt}")
+        counts[table] = _write_table(table, path, fmt, batch_size)
+    return counts
+
+
+def import_data(src_dir: str, fmt: str = 'jsonl', batch_size: int = storage.EXPORT_BATCH_SIZE,
+                skip_existing: bool = False) -> dict:
+    storage.init_db()
+    counts = {}
+    # EXPORT_TABLES order: orders first so order_items/chat references resolve
+    for table in storage.EXPORT_TABLES:
+        path = os.path.join(src_dir, f"{table}.{fmt}")
+        if not os.path.exists(path):
+            continue
+        counts[table] = storage.import_rows(table, _read_batches(table, path, fmt, batch_size),
+                                            skip_existing=skip_existing)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk export/import of Kirana store data.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name in ('export', 'import'):
+        p = sub.add_parser(name)
+        p.add_argument('--format', choices=FORMATS, default='jsonl')
+        p.add_argument('--store', default=storage.DEFAULT_STORE)
+        p.add_argument('--batch-size', type=int, default=storage.EXPORT_BATCH_SIZE)
+    sub.choices['export'].add_argument('--out', required=True, help="output directory")
+    sub.choices['import'].add_argument('--src', required=True, help="directory with exported files")
+    sub.choices['import'].add_argument('--skip-existing', action='store_true',
+                                       help="ignore rows whose key already exists")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    with storage.use_store(args.store):
+        if args.command == 'export':
+            counts = export_data(args.out, args.format, args.batch_size)
+        else:
+            counts = import_data(args.src, args.format, args.batch_size, args.skip_existing)
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    for table, n in counts.items():
+        print(f"{args.command}ed {n:>10} rows  {table}")
+    print(f"{total} rows in {elapsed:.2f}s ({total / elapsed if elapsed else 0:,.0f} rows/s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import hashlib
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+# Process-wide gate in front of every model.generate_content call. A call
+# waits in a priority queue until it is at the head, a concurrency slot is free
+# and the token bucket has a token. Identical prompts already in flight share one
+# call (single flight). Consecutive failures open a circuit breaker so a quota
+# outage fails fast instead of piling retries onto the provider.
+
+PRIORITY_ORDER = 0
+PRIORITY_STATUS = 1
+PRIORITY_DEFAULT = 2
+PRIORITY_GREETING = 3
+
+MAX_CONCURRENCY = int(os.getenv('KIRANA_LLM_CONCURRENCY', '4'))
+RATE_PER_SECOND = float(os.getenv('KIRANA_LLM_RPS', '5'))
+BURST = int(os.getenv('KIRANA_LLM_BURST', '10'))
+CALL_TIMEOUT = float(os.getenv('KIRANA_LLM_TIMEOUT', '30'))
+MAX_QUEUE = int(os.getenv('KIRANA_LLM_MAX_QUEUE', '100'))
+BREAKER_FAILURES = int(os.getenv('KIRANA_LLM_BREAKER_FAILURES', '5'))
+BREAKER_COOLDOWN = float(os.getenv('KIRANA_LLM_BREAKER_COOLDOWN', '30'))
+
+class ModelUnavailable(Exception):
+    """Call rejected by the governor (breaker open, queue full or timed out)."""
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+class ModelGovernor:
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, rate: float = RATE_PER_SECOND,
+                 burst: int = BURST, timeout: float = CALL_TIMEOUT, max_queue: int = MAX_QUEUE,
+                 breaker_failures: int = BREAKER_FAILURES,
+                 breaker_cooldown: float = BREAKER_COOLDOWN):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self._bucket = TokenBucket(rate, burst)
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._inflight = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='llm')
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._half_open_trial = False
+        self._waits = deque(maxlen=500)
+        self._counts = {'calls': 0, 'completed': 0, 'failed': 0, 'timeouts': 0, 'deduplicated': 0,
+                        'rejected_breaker': 0, 'rejected_queue': 0, 'rejected_wait': 0}
+
+    # ---------------- public API -----------------
+    def generate(self, model, prompt: str, priority: int = PRIORITY_DEFAULT, timeout: float = None):
+        """model.generate_content(prompt) under the governor's limits."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        key = (id(model), hashlib.sha1(prompt.encode('utf-8')).hexdigest())
+        with self._cond:
+            self._counts['calls'] += 1
+            shared = self._inflight.get(key)
+            owner = shared is None
+            if owner:
+                self._check_breaker()
+                shared = Future()
+                self._inflight[key] = shared
+            else:
+                self._counts['deduplicated'] += 1
+        if not owner:
+            return self._await(shared, deadline)
+        # This caller makes the call; followers with the same prompt wait on `shared`
+        try:
+            result = self._run(model, prompt, priority, deadline)
+        except BaseException as e:
+            shared.set_exception(e)
+            raise
+        else:
+            shared.set_result(result)
+            return result
+        finally:
+            with self._cond:
+                self._inflight.pop(key, None)
+
+    def metrics(self) -> dict:
+        with self._cond:
+            waits = sorted(self._waits)
+            out = dict(self._counts)
+            out.update({
+                'queue_depth': len(self._heap),
+                'active': self._active,
+                'breaker': self._breaker_state(),
+                'queue_wait_avg_ms': (sum(waits) / len(waits) * 1000) if waits else 0.0,
+                'queue_wait_p95_ms': (waits[int(len(waits) * 0.95) - 1] * 1000) if waits else 0.0,
+                'queue_wait_max_ms': (waits[-1] * 1000) if waits else 0.0,
+            })
+        return out
+
+    # ---------------- internals -----------------
+    def _await(self, shared: Future, deadline: float):
+        try:
+            return shared.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            with self._cond:
+                self._counts['timeouts'] += 1
+            raise ModelUnavailable("timed out waiting for identical in-flight request")
+
+    def _breaker_state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.breaker_cooldown:
+            return 'half-open'
+        return 'open'
+
+    def _check_breaker(self):
+        state = self._breaker_state()
+        if state == 'open' or (state == 'half-open' and self._half_open_trial):
+            self._counts['rejected_breaker'] += 1
+            raise ModelUnavailable("model circuit breaker open")
+        if state == 'half-open':
+            self._half_open_trial = True  # let exactly one probe through
+
+    def _acquire_slot(self, priority: int, deadline: float):
+        enqueued = time.monotonic()
+        with self._cond:
+            if len(self._heap) >= self.max_queue:
+                self._counts['rejected_queue'] += 1
+                raise ModelUnavailable("model queue full")
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._heap, entry)
+            while True:
+                if (self._heap[0] == entry and self._active < self.max_concurrency
+                        and self._bucket.try_take()):
+                    heapq.heappop(self._heap)
+                    self._active += 1
+                    self._waits.append(time.monotonic() - enqueued)
+                    self._cond.notify_all()
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._heap.remove(entry)
+                    heapq.heapify(self._heap)
+                    self._counts['rejected_wait'] += 1
+                    self._cond.notify_all()
+                    raise ModelUnavailable("timed out waiting for a model slot")
+                self._cond.wait(min(remaining, self._bucket.wait_time() or remaining))
+
+    def _release_slot(self, _future=None):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def _record(self, ok: bool, timed_out: bool = False):
+        with self._cond:
+            if ok:
+                self._counts['completed'] += 1
+                self._consecutive_failures = 0
+                self._opened_at = None
+            else:
+                self._counts['timeouts' if timed_out else 'failed'] += 1
+                self._consecutive_failures += 1
+                if (self._consecutive_failures >= self.breaker_failures
+                        or self._opened_at is not None):
+                    self._opened_at = time.monotonic()
+            self._half_open_trial = False
+
+    def _run(self, model, prompt: str, priority: int, deadline: float):
+        try:
+            self._acquire_slot(priority, deadline)
+        except ModelUnavailable:
+            with self._cond:
+                self._half_open_trial = False
+            raise
+        # The slot stays held until the provider call really finishes, even if
+        # the caller gives up on it, so concurrency never exceeds the limit.
+        try:
+            call = self._executor.submit(model.generate_content, prompt)
+        except BaseException:
+            # e.g. model is None: the slot was taken but no call will release it
+            self._release_slot()
+            self._record(False)
+            raise
+        call.add_done_callback(self._release_slot)
+        try:
+            result = call.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            self._record(False, timed_out=True)
+            raise ModelUnavailable("model call timed out")
+        except Exception:
+            self._record(False)
+            raise
+        self._record(True)
+        return result
+
+_governor = None
+_governor_lock = threading.Lock()
+
+def get_governor() -> ModelGovernor:
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = ModelGovernor()
+    return _governor
+
+def generate(model, prompt: str, priority: int = PRIORITY_DEFAULT, timeout: float = None):
+    return get_governor().generate(model, prompt, priority, timeout)
@@ -0,0 +1,112 @@
+from functools import lru_cache
+from html import escape
+
+from storage import SNIPPET_CLOSE, SNIPPET_OPEN
+
+# HTML for the chat, inventory and orders panels and search results. Each panel is built as one
+# fragment and sent with a single st.markdown call, instead of one element
+# per message/card. Fragments are memoized on their content, so a rerun with
+# unchanged data reuses the previous string. All user- and model-provided
+# text is HTML-escaped here.
+
+INVENTORY_CARDS_MAX = 200   # large catalogs: low-stock items first, then the rest up to this many
+
+STATUS_COLORS = {
+    'processing': '#ffc107',
+    'out-for-delivery': '#17a2b8',
+    'delivered': '#28a745',
+}
+STATUS_ICONS = {
+    'processing': '🔄',
+    'out-for-delivery': '🚚',
+    'delivered': '✅',
+}
+
+def _text(value) -> str:
+    return escape(str(value)).replace('\n', '<br>')
+
+# ---------------- Chat -----------------
+@lru_cache(maxsize=1024)
+def _chat_bubble(role: str, text: str) -> str:
+    side, cls = ('flex-end', 'msg-user') if role == 'user' else ('flex-start', 'msg-ai')
+    return (f'<div style="display: flex; justify-content: {side}; margin: 5px 0;">'
+            f'<div class="msg-bubble {cls}">{_text(text)}</div></div>')
+
+@lru_cache(maxsize=32)
+def _chat_panel(messages: tuple) -> str:
+    return ''.join(_chat_bubble(role, text) for role, text in messages)
+
+def chat_html(chat, limit: int = 30) -> str:
+    return _chat_panel(tuple((m['role'], m['text']) for m in chat[-limit:]))
+
+# ---------------- Inventory -----------------
+@lru_cache(maxsize=4096)
+def _inventory_card(name: str, stock: int, unit: str, price: float, is_low: bool) -> str:
+    card_class = "inventory-card low-stock" if is_low else "inventory-card"
+    icon = "⚠️" if is_low else "✅"
+    unit = _text(unit)
+    color = "#dc3545" if is_low else "#25d366"
+    return (f'<div class="{card_class}">'
+            f'<div style="display: flex; justify-content: space-between; align-items: center;">'
+            f'<div><h4 style="margin: 0; color: #333;">{icon} {_text(name)}</h4>'
+            f'<p style="margin: 5px 0 0 0; color: #666;">₹{price}/{unit}</p></div>'
+            f'<div style="text-align: right;"><h3 style="margin: 0; color: {color};">{stock}</h3>'
+            f'<p style="margin: 0; color: #666;">{unit}s</p></div></div></div>')
+
+@lru_cache(maxsize=32)
+def _inventory_panel(cards: tuple, hidden: int) -> str:
+    more = f'<p style="color: #666;">…and {hidden} more items</p>' if hidden else ''
+    return ''.join(_inventory_card(*card) for card in cards) + more
+
+def shown_items(inventory: dict, monitor, limit: int = INVENTORY_CARDS_MAX):
+    """(names to display, number left out).
+
+    Everything for small catalogs, else low-stock items first.
+    """
+    names = list(inventory)
+    if len(names) > limit:
+        names = sorted(monitor.low) + [n for n in names if n not in monitor.low]
+    return names[:limit], max(0, len(names) - limit)
+
+def inventory_html(catalog, inventory: dict, monitor) -> str:
+    shown, hidden = shown_items(inventory, monitor)
+    cards = []
+    for name in shown:
+        info = catalog[name]
+        stock = inventory[name]
+        cards.append((name, stock, info['unit'], info['price'], monitor.is_low(name, stock)))
+    return _inventory_panel(tuple(cards), hidden)
+
+# ---------------- Orders -----------------
+@lru_cache(maxsize=1024)
+def _order_card(order_id: int, status: str, items: tuple, total: float) -> str:
+    items_text = _text(', '.join(f"{qty} {name}" for name, qty in items))
+    icon = STATUS_ICONS.get(status, "📦")
+    color = STATUS_COLORS.get(status, "#6c757d")
+    return (f'<div class="order-card status-{escape(status)}">'
+            f'<div style="display: flex; justify-content: space-between; align-items: center;">'
+            f'<div><h4 style="margin: 0; color: #333;">{icon} Order #{order_id}</h4>'
+            f'<p style="margin: 5px 0; color: #666;">{items_text}</p>'
+            f'<span style="background: {color}; color: white; padding: 3px 8px; '
+            f'border-radius: 15px; font-size: 12px;">'
+            f'{_text(status.replace("-", " ").title())}</span></div>'
+            f'<div style="text-align: right;">'
+            f'<h3 style="margin: 0; color: #25d366;">₹{total:.2f}</h3></div></div></div>')
+
+@lru_cache(maxsize=32)
+def _orders_panel(cards: tuple) -> str:
+    return ''.join(_order_card(*card) for card in cards)
+
+def orders_html(orders, limit: int = 10) -> str:
+    return _orders_panel(tuple(
+        (o['id'], o.get('status', 'processing'), tuple(tuple(pair) for pair in o['items']),
+         o.get('total_amount', 0.0))
+        for o in orders[-limit:][::-1]
+    ))
+
+# ---------------- Search -----------------
+def search_result_html(label: str, ts: str, snippet: str) -> str:
+    # Brackets as entities too, so markdown links/images in messages stay plain text
+    marked = (_text(snippet).replace('[', '&#91;').replace(']', '&#93;')
+              .replace(SNIPPET_OPEN, '<mark>').replace(SNIPPET_CLOSE, '</mark>'))
+    return f'<div style="margin: 4px 0;"><b>{_text(label)}</b> · {_text(ts)} — {marked}</div>'
@@ -0,0 +1,199 @@
+import re
+import threading
+from functools import lru_cache
+
+# Maps free-form item names from the model or the customer ("doodh packet",
+# "Maggi", "chaawal", "दूध") to catalog keys without another LLM call.
+# Lookup order: exact key -> normalized phrase -> every normalized token, each
+# exactly or via trigram candidates verified by edit distance, naming the same
+# key. Everything is precomputed per catalog.
+
+# ---------------- Devanagari -> Latin (rough, Hinglish-style) -----------------
+_CONSONANTS = {
+    'क': 'k', 'ख': 'kh', 'ग': 'g', 'घ': 'gh', 'ङ': 'n',
+    'च': 'ch', 'छ': 'chh', 'ज': 'j', 'झ': 'jh', 'ञ': 'n',
+    'ट': 't', 'ठ': 'th', 'ड': 'd', 'ढ': 'dh', 'ण': 'n',
+    'त': 't', 'थ': 'th', 'द': 'd', 'ध': 'dh', 'न': 'n',
+    'प': 'p', 'फ': 'ph', 'ब': 'b', 'भ': 'bh', 'म': 'm',
+    'य': 'y', 'र': 'r', 'ल': 'l', 'व': 'v', 'श': 'sh',
+    'ष': 'sh', 'स': 's', 'ह': 'h', 'ळ': 'l',
+}
+_VOWELS = {
+    'अ': 'a', 'आ': 'aa', 'इ': 'i', 'ई': 'ee', 'उ': 'u', 'ऊ': 'oo',
+    'ऋ': 'ri', 'ए': 'e', 'ऐ': 'ai', 'ओ': 'o', 'औ': 'au',
+}
+_MATRAS = {
+    'ा': 'aa', 'ि': 'i', 'ी': 'ee', 'ु': 'u', 'ू': 'oo',
+    'ृ': 'ri', 'े': 'e', 'ै': 'ai', 'ो': 'o', 'ौ': 'au',
+}
+_SIGNS = {'ं': 'n', 'ँ': 'n', 'ः': 'h'}
+_VIRAMA = '्'
+_NUKTA = '़'
+_NUKTA_FORMS = {'ड': 'r', 'ढ': 'rh', 'क': 'q', 'ख': 'kh', 'ग': 'g', 'ज': 'z', 'फ': 'f'}
+_DEVANAGARI_RE = re.compile(r'[ऀ-ॿ]')
+
+def transliterate(text: str) -> str:
+    if not _DEVANAGARI_RE.search(text):
+        return text
+    out = []
+    n = len(text)
+    i = 0
+    while i < n:
+        ch = text[i]
+        if ch in _CONSONANTS:
+            latin = _CONSONANTS[ch]
+            if i + 1 < n and text[i + 1] == _NUKTA:
+                latin = _NUKTA_FORMS.get(ch, latin)
+                i += 1
+            out.append(latin)
+            nxt = text[i + 1] if i + 1 < n else ''
+            if nxt in _MATRAS:
+                out.append(_MATRAS[nxt])
+                i += 1
+            elif nxt == _VIRAMA:
+                i += 1
+            elif nxt in _CONSONANTS or nxt in _SIGNS:
+                # Inherent vowel; dropped at word end (schwa deletion)
+                out.append('a')
+        elif ch in _VOWELS:
+            out.append(_VOWELS[ch])
+        elif ch in _SIGNS:
+            out.append(_SIGNS[ch])
+        elif ch == _NUKTA or ch == _VIRAMA:
+            pass
+        else:
+            out.append(ch)
+        i += 1
+    return ''.join(out)
+
+# ---------------- Normalization -----------------
+# Spelling variants common in romanized Hindi collapse to one form
+_FOLDS = [('aa', 'a'), ('ee', 'i'), ('oo', 'u'), ('ou', 'u'), ('ph', 'f'), ('w', 'v'), ('z', 'j'),
+          ('q', 'k'), ('ck', 'k'), ('ea', 'e'), ('y', 'i')]
+_REPEATS_RE = re.compile(r'(.)\1+')
+_NON_WORD_RE = re.compile(r'[^a-z0-9]+')
+STOP_WORDS = {
+    'packet', 'packets', 'pkt', 'pack', 'kilo', 'kg', 'kgs', 'gram', 'grams', 'g', 'loaf', 'loaves',
+    'litre', 'liter', 'ltr', 'l', 'piece', 'pieces', 'pcs', 'bottle', 'box', 'bag',
+    'the', 'of', 'and', 'aur', 'ka', 'ki', 'ke',
+    'wala', 'wali', 'vala', 'vali', 'some', 'please', 'plz', 'ek', 'do', 'teen', 'char', 'paanch',
+}
+
+def _fold(token: str) -> str:
+    for a, b in _FOLDS:
+        token = token.replace(a, b)
+    token = _REPEATS_RE.sub(r'\1', token)
+    # Trailing aspirate is often dropped: dudh/dud, dal/daal
+    if len(token) > 3 and token.endswith('h') and token[-2] not in 'cs':
+        token = token[:-1]
+    return token
+
+# Transliterated Hindi fillers (का -> kaa -> ka, पैकेट -> paiket) must match after folding too
+_FOLDED_STOP_WORDS = STOP_WORDS | {_fold(w) for w in STOP_WORDS} | {'paiket'}
+
+def tokens(text: str):
+    latin = transliterate(str(text).lower())
+    raw = [t for t in _NON_WORD_RE.split(latin) if t and not t.isdigit()]
+    folded = (_fold(t) for t in raw if t not in STOP_WORDS)
+    return [t for t in folded if t not in _FOLDED_STOP_WORDS]
+
+def normalize(text: str) -> str:
+    return ' '.join(tokens(text))
+
+# Shorter terms are one edit away from too many real words ("ice" -> rice, "mil" -> milk)
+FUZZY_MIN_LEN = 5
+
+def _trigrams(s: str):
+    s = f"  {s} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, giving up (returns limit + 1) once it exceeds limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        best = i
+        for j, cb in enumerate(b, 1):
+            v = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            cur.append(v)
+            best = min(best, v)
+        if best > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+class NameIndex:
+    def __init__(self, catalog: dict):
+        self.keys = set(catalog)
+        self.exact = {}      # normalized phrase or token -> sku (None if ambiguous)
+        self.trigrams = {}   # trigram -> set of normalized terms
+        for sku, info in catalog.items():
+            for alias in [sku] + list(info.get('hindi', [])) + list(info.get('aliases', [])):
+                toks = tokens(alias)
+                for term in [' '.join(toks)] + toks:
+                    if not term:
+                        continue
+                    prev = self.exact.get(term, sku)
+                    self.exact[term] = sku if prev == sku else None
+                    for g in _trigrams(term):
+                        self.trigrams.setdefault(g, set()).add(term)
+        self.resolve = lru_cache(maxsize=4096)(self._resolve)
+
+    def _fuzzy(self, term: str):
+        if len(term) < FUZZY_MIN_LEN:
+            return None
+        grams = _trigrams(term)
+        counts = {}
+        for g in grams:
+            for cand in self.trigrams.get(g, ()):
+                counts[cand] = counts.get(cand, 0) + 1
+        best, best_dist = None, None
+        limit = max(1, len(term) // 4)
+        for cand, shared in sorted(counts.items(), key=lambda kv: -kv[1])[:20]:
+            if shared / len(grams | _trigrams(cand)) < 0.2:
+                continue
+            d = edit_distance(term, cand, limit)
+            if d <= limit and (best_dist is None or d < best_dist):
+                best, best_dist = cand, d
+        return self.exact.get(best) if best else None
+
+    def _resolve(self, name: str):
+        if name in self.keys:
+            return name
+        toks = tokens(name)
+        if not toks:
+            return None
+        phrase = ' '.join(toks)
+        if self.exact.get(phrase):
+            return self.exact[phrase]
+        # Every word must name the same item: 'rice flour' isn't rice and 'milk chocolate'
+        # isn't milk. Unknown words or two different items are left to the model.
+        found = None
+        for t in toks:
+            sku = self.exact.get(t) or self._fuzzy(t)
+            if sku is None or (found is not None and sku != found):
+                return None
+            found = sku
+        return found
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def index_for(catalog: dict) -> NameIndex:
+    # Catalog dicts are long-lived (module constant / per-store cache), so key by identity
+    entry = _indexes.get(id(catalog))
+    if entry is None or entry[0] is not catalog:
+        with _indexes_lock:
+            entry = (catalog, NameIndex(catalog))
+            _indexes[id(catalog)] = entry
+    return entry[1]
+
+def resolve_item_name(catalog: dict, name) -> str:
+    """Catalog key for a free-form item name, or None if it can't be resolved confidently."""
+    if not name:
+        return None
+    if name in catalog:
+        return name  # already a key; no need to build the index for large catalogs
+    return index_for(catalog).resolve(str(name))
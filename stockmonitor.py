@@ -0,0 +1,101 @@
+import os
+import threading
+
+from storage import consumption_history
+
+# Low-stock tracking driven by stock-change events instead of rescanning the
+# whole inventory on every render, plus a batched reorder forecast over the
+# order_items history. Catalog entries may set their own alert level with
+# 'low_stock' (same unit as 'qty'); everything else uses LOW_STOCK_THRESHOLD.
+
+LOW_STOCK_THRESHOLD = int(os.getenv('KIRANA_LOW_STOCK_THRESHOLD', '5'))
+FORECAST_WINDOW_DAYS = int(os.getenv('KIRANA_FORECAST_DAYS', '14'))
+FORECAST_HALF_LIFE_DAYS = 7.0   # recent days weigh more in the consumption rate
+RESTOCK_LEAD_DAYS = float(os.getenv('KIRANA_RESTOCK_LEAD_DAYS', '2'))
+COVER_TARGET_DAYS = float(os.getenv('KIRANA_COVER_TARGET_DAYS', '7'))
+
+def threshold_for(catalog: dict, name: str) -> int:
+    return catalog.get(name, {}).get('low_stock', LOW_STOCK_THRESHOLD)
+
+class StockMonitor:
+    def __init__(self, catalog: dict):
+        self.catalog = catalog
+        self.low = {}          # item -> stock, only items currently below threshold
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.changes = 0       # bumped on every stock event; lets callers cache derived views
+
+    def subscribe(self, fn):
+        """fn(item, stock) is called when an item drops below its threshold."""
+        self._listeners.append(fn)
+
+    def is_low(self, name: str, stock: int) -> bool:
+        return stock < threshold_for(self.catalog, name)
+
+    def reset(self, inventory: dict):
+        """Full recompute; only needed when the inventory is rebuilt wholesale."""
+        with self._lock:
+            self.low = {name: stock for name, stock in inventory.items()
+                        if self.is_low(name, stock)}
+            self.changes += 1
+
+    def update(self, name: str, stock: int):
+        with self._lock:
+            self.changes += 1
+            was_low = name in self.low
+            if not self.is_low(name, stock):
+                self.low.pop(name, None)
+                return
+            self.low[name] = stock
+        if not was_low:
+            for fn in self._listeners:
+                fn(name, stock)
+
+    def alerts(self):
+        return [f"{item} ({stock} left)" for item, stock in sorted(self.low.items())]
+
+def monitor_for(state, catalog: dict) -> StockMonitor:
+    monitor = getattr(state, 'stock_monitor', None)
+    if monitor is None or monitor.catalog is not catalog:
+        monitor = StockMonitor(catalog)
+        monitor.reset(state.inventory)
+        state.stock_monitor = monitor
+    return monitor
+
+# ---------------- Forecast -----------------
+def forecast(catalog: dict, inventory: dict, window_days: int = FORECAST_WINDOW_DAYS,
+             lead_days: float = RESTOCK_LEAD_DAYS, cover_days: float = COVER_TARGET_DAYS, now=None):
+    """Daily consumption rate, days of cover and suggested reorder qty for every catalog item.
+
+    One query and a handful of array operations regardless of catalog size.
+    Rows come back most urgent first; items with no sales have infinite cover.
+    """
+    import numpy as np
+
+    names = list(catalog)
+    if not names:
+        return []
+    pos = {name: i for i, name in enumerate(names)}
+    sold = np.zeros((len(names), window_days))
+    rows = [(pos[n], age, qty) for n, age, qty in consumption_history(window_days, now)
+            if n in pos and 0 <= age < window_days]
+    if rows:
+        item_idx, age_idx, qty = (np.array(col) for col in zip(*rows))
+        np.add.at(sold, (item_idx, age_idx), qty)
+
+    weights = 0.5 ** (np.arange(window_days) / FORECAST_HALF_LIFE_DAYS)
+    rate = sold @ weights / weights.sum()
+    stock = np.array([inventory.get(n, 0) for n in names], dtype=float)
+    threshold = np.array([threshold_for(catalog, n) for n in names], dtype=float)
+    cover = np.divide(stock, rate, out=np.full(len(names), np.inf), where=rate > 0)
+    # Refill to lead time + target cover of expected demand, plus the alert level as safety stock
+    target = rate * (lead_days + cover_days) + threshold
+    reorder = np.where((cover < lead_days + cover_days) | (stock < threshold),
+                       np.ceil(np.maximum(0.0, target - stock)), 0.0)
+
+    order = np.lexsort((-reorder, cover))
+    return [
+        {"name": names[i], "stock": int(stock[i]), "daily_rate": float(rate[i]),
+         "days_of_cover": float(cover[i]), "reorder_qty": int(reorder[i])}
+        for i in order
+    ]
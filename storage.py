@@ -1,88 +1,18 @@
-import sqlite3
+import contextlib
+import contextvars
+import functools
+import itertools
 import json
 import os
-from datetime import datetime
-
-DB_PATH = os.path.join(os.path.dirname(__file__), 'data.db')
-
-def get_conn():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
-
-def init_db():
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("""CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY,
-            created_at TEXT,
-            status TEXT,
-            total_amount REAL,
-            items_json TEXT,
-            raw_request TEXT,
-            response_text TEXT
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS chat_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts TEXT,
-            role TEXT,
-            text TEXT,
-            order_id INTEGER NULL,
-            FOREIGN KEY(order_id) REFERENCES orders(id)
-        )""")
-        conn.commit()
-
-def save_order(order_id:int, status:str, items:list, raw_request:str, response_text:str, total:float):
-    with get_conn() as conn:
-        conn.execute("REPLACE INTO orders (id, created_at, status, total_amount, items_json, raw_request, response_text) VALUES (?,?,?,?,?,?,?)",
-                     (order_id, datetime.utcnow().isoformat(), status, total, json.dumps(items), raw_request, response_text))
-        conn.commit()
-
-def update_order_status(order_id:int, status:str):
-    with get_conn() as conn:
-        conn.execute("UPDATE orders SET status=? WHERE id=?", (status, order_id))
-        conn.commit()
-
-def load_orders():
-    with get_conn() as conn:
-        rows = conn.execute("SELECT id, status, total_amount, items_json FROM orders ORDER BY id ASC").fetchall()
-    orders = []
-    for rid, status, total, items_json in rows:
-        try:
-            items = json.loads(items_json)
-        except Exception:
-            items = []
-        tuple_items = [(i['name'], i['qty']) for i in items]
-        orders.append({"id": rid, "status": status, "total_amount": total, "items": tuple_items})
-    return orders
-
-def save_chat(role:str, text:str, order_id=None):
-    with get_conn() as conn:
-        conn.execute("INSERT INTO chat_messages (ts, role, text, order_id) VALUES (?,?,?,?)",
-                     (datetime.utcnow().isoformat(), role, text, order_id))
-        conn.commit()
-
-def load_chat(limit:int=200):
-    with get_conn() as conn:
-        rows = conn.execute("SELECT ts, role, text, IFNULL(order_id,'') FROM chat_messages ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
-    messages = []
-    for ts, role, text, oid in rows:
-        messages.append({"ts": ts, "role": role, "text": text, "order_id": oid if oid!='' else None})
-    return list(reversed(messages))
-
-def price_for_item(name:str) -> float:
-    # Updated prices to match INVENTORY
-    base = {
-        'milk': 25.0,
-        'bread': 35.0,
-        'rice': 80.0,
-        'maggi': 15.0
-    }
-    return base.get(name, 10.0)
-import os
+import queue
+import re
 import sqlite3
-import json
 import threading
-import queue
-from datetime import datetime
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 DB_PATH = os.path.join(os.path.dirname(__file__), 'data.db')
 
@@ -97,12 +27,488 @@ PRICES = {
     'maggi': 15.0,
 }
 
-def get_connection():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+# ---------------- Query profiling -----------------
+# Connections from _connect() time every statement: calls, wall time (execute
+# plus fetches), rows returned, time spent waiting for a lock, VM steps
+# counted by a progress handler and, from a trace callback, the nested
+# statements each one caused (triggers and FTS5 index upkeep) plus the BEGIN
+# that sqlite3 issues implicitly.
+# Statements slower than SLOW_QUERY_MS are appended to SLOW_QUERY_LOG as JSON
+# lines (KIRANA_SLOW_QUERY_LOG= disables the file; the last few stay in memory).
+#
+# SQLite's own busy handler doesn't say how long it slept, so profiled
+# connections use busy_timeout 0 and retry SQLITE_BUSY here, with backoff,
+# for up to BUSY_TIMEOUT_SECONDS; the time slept is the lock wait.
+PROFILE_SQL = os.getenv('KIRANA_PROFILE_SQL', '1') == '1'
+SLOW_QUERY_MS = float(os.getenv('KIRANA_SLOW_QUERY_MS', '100'))
+SLOW_QUERY_LOG = os.getenv('KIRANA_SLOW_QUERY_LOG',
+                           os.path.join(os.path.dirname(__file__), 'slow_queries.log'))
+BUSY_TIMEOUT_SECONDS = 5.0   # sqlite3.connect's default timeout
+PROGRESS_STEPS = 1000        # VM instructions per progress-handler call
+_SQL_KEY_MAX = 300
+_SQLITE_BUSY_SNAPSHOT = 517  # stale WAL snapshot: waiting never helps, the transaction must restart
+
+class QueryStats:
+    """Per-statement totals, keyed by the statement text with whitespace collapsed."""
+
+    def __init__(self, slow_keep: int = 200):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.slow = deque(maxlen=slow_keep)
+        self.since = datetime.utcnow().isoformat()
+
+    def record(self, sql: str, seconds: float, rows: int = 0, lock_wait: float = 0.0,
+               steps: int = 0, nested: int = 0, path: str = None):
+        with self._lock:
+            s = self._stats.get(sql)
+            if s is None:
+                s = self._stats[sql] = {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0,
+                                        'lock_wait': 0.0, 'vm_steps': 0, 'nested': 0}
+            s['calls'] += 1
+            s['seconds'] += seconds
+            s['max_seconds'] = max(s['max_seconds'], seconds)
+            s['rows'] += rows
+            s['lock_wait'] += lock_wait
+            s['vm_steps'] += steps
+            s['nested'] += nested
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            self._log_slow({'ts': datetime.utcnow().isoformat(), 'db': os.path.basename(path or ''),
+                            'ms': round(seconds * 1000, 2),
+                            'lock_wait_ms': round(lock_wait * 1000, 2),
+                            'rows': rows, 'vm_steps': steps, 'sql': sql})
+
+    def _log_slow(self, entry: dict):
+        with self._lock:
+            self.slow.append(entry)
+            if not SLOW_QUERY_LOG:
+                return
+            try:
+                with open(SLOW_QUERY_LOG, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            except OSError:
+                pass  # profiling must never fail the query it measured
+
+    def top(self, limit: int = 20, order_by: str = 'total_ms'):
+        with self._lock:
+            items = [(sql, dict(s)) for sql, s in self._stats.items()]
+        rows = [{'sql': sql, 'calls': s['calls'], 'total_ms': s['seconds'] * 1000,
+                 'avg_ms': s['seconds'] * 1000 / s['calls'], 'max_ms': s['max_seconds'] * 1000,
+                 'rows': s['rows'], 'lock_wait_ms': s['lock_wait'] * 1000,
+                 'vm_steps': s['vm_steps'], 'nested': s['nested']}
+                for sql, s in items]
+        rows.sort(key=lambda r: r[order_by], reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.slow.clear()
+            self.since = datetime.utcnow().isoformat()
+
+_query_stats = QueryStats()
+
+@functools.lru_cache(maxsize=1024)
+def _sql_key(sql: str) -> str:
+    return ' '.join(sql.split())[:_SQL_KEY_MAX]
+
+def _is_busy(e: sqlite3.OperationalError) -> bool:
+    code = getattr(e, 'sqlite_errorcode', None)  # Python 3.11+
+    if code is None:
+        return 'database is locked' in str(e)
+    return code & 0xff == sqlite3.SQLITE_BUSY and code != _SQLITE_BUSY_SNAPSHOT
+
+def _retry_busy(fn, *args):
+    """fn(*args), retrying while the database is locked.
+
+    Returns (result, seconds waited, retries).
+    """
+    waited, delay, retries = 0.0, 0.001, 0
+    while True:
+        try:
+            return fn(*args), waited, retries
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e) or waited >= BUSY_TIMEOUT_SECONDS:
+                raise
+        retries += 1
+        time.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, 0.05)
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Accumulates one statement's time and rows across execute and fetches.
+
+    Recorded when the statement is done.
+    """
+
+    # [sql key, seconds, rows, lock wait, executions, vm ticks and traced count at start]
+    _pending = None
+
+    def _start(self, sql: str):
+        self._finish()
+        conn = self.connection
+        self._pending = [_sql_key(sql), 0.0, 0, 0.0, 0, conn._vm_ticks, conn._traced]
+
+    def _add(self, started: float, rows: int):
+        if self._pending is not None:
+            self._pending[1] += time.perf_counter() - started
+            self._pending[2] += rows
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            conn = self.connection
+            sql, seconds, rows, lock_wait, executions, ticks, traced = pending
+            # Each execution traces once; anything beyond that ran nested (triggers, FTS5)
+            steps = (conn._vm_ticks - ticks) * PROGRESS_STEPS
+            nested = max(0, conn._traced - traced - executions)
+            _query_stats.record(sql, seconds, rows, lock_wait, steps, nested, conn.path)
+
+    def execute(self, sql, parameters=()):
+        self._start(sql)
+        started = time.perf_counter()
+        _, self._pending[3], retries = _retry_busy(super().execute, sql, parameters)
+        self._pending[4] = 1 + retries
+        self._add(started, 0)
+        if self.description is None:
+            self._finish()   # DML/DDL: nothing left to fetch
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql)
+        params = seq_of_parameters
+        if not isinstance(params, (list, tuple)):
+            params = list(params)
+        started = time.perf_counter()
+        _, self._pending[3], retries = _retry_busy(super().executemany, sql, params)
+        self._pending[4] = len(params) + retries
+        self._add(started, 0)
+        self._finish()
+        return self
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._add(started, row is not None)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._add(started, len(rows))
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._add(started, len(rows))
+        self._finish()
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._add(started, 0)
+            self._finish()
+            raise
+        self._add(started, 1)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Single-row lookups (`conn.execute(...).fetchone()`) are recorded when the cursor goes away
+        self._finish()
+
+class ProfiledConnection(sqlite3.Connection):
+    path = None
+    _vm_ticks = 0
+    _traced = 0
+
+    def _tick(self):
+        self._vm_ticks += 1
+        return 0
+
+    def _trace(self, statement: str):
+        # Nested statements are reported with the text of the statement that caused them
+        if statement.rstrip() == 'BEGIN':
+            _query_stats.record('BEGIN (implicit)', 0.0, path=self.path)
+        else:
+            self._traced += 1
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        if not self.in_transaction:
+            return
+        started = time.perf_counter()
+        _, waited, _ = _retry_busy(super().commit)
+        _query_stats.record('COMMIT', time.perf_counter() - started, lock_wait=waited,
+                            path=self.path)
+
+def query_stats(limit: int = 20, order_by: str = 'total_ms'):
+    """Busiest statements since the last reset_query_stats(), heaviest first."""
+    return _query_stats.top(limit, order_by)
+
+def slow_queries(limit: int = 50):
+    return list(_query_stats.slow)[-limit:][::-1]
+
+def reset_query_stats():
+    _query_stats.reset()
+
+def query_stats_since() -> str:
+    return _query_stats.since
+
+# ---------------- Stores: per-store database files and connection pools -----------------
+# Every store gets its own SQLite file (the 'default' store keeps data.db), so
+# stores never contend on one hot file. The active store is a context variable:
+# the app sets it once per rerun, workers wrap calls in use_store(store_id).
+DEFAULT_STORE = 'default'
+STORES_DIR = os.getenv('KIRANA_STORES_DIR') or os.path.join(os.path.dirname(__file__), 'stores')
+POOL_SIZE = int(os.getenv('KIRANA_POOL_SIZE', '4'))
+_STORE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+# Stores that may be opened (and created) from a request; others must already have a database file.
+# The deployment's own KIRANA_STORE_ID is always allowed.
+ALLOWED_STORES = {s.strip()
+                  for s in (os.getenv('KIRANA_ALLOWED_STORES', '') + ','
+                            + os.getenv('KIRANA_STORE_ID', '')).split(',')
+                  if s.strip()}
+
+_current_store = contextvars.ContextVar('kirana_store', default=DEFAULT_STORE)
+# (db path, _TxConnection) inside transaction()
+_current_tx = contextvars.ContextVar('kirana_tx', default=None)
+_pools = {}
+_pools_lock = threading.Lock()
+
+def db_path_for(store_id: str = None) -> str:
+    store_id = store_id or _current_store.get()
+    if store_id == DEFAULT_STORE:
+        return DB_PATH
+    if not _STORE_ID_RE.match(store_id):
+        raise ValueError(f"invalid store id: {store_id!r}")
+    return os.path.join(STORES_DIR, f"{store_id}.db")
+
+def current_store() -> str:
+    return _current_store.get()
+
+def activate_store(store_id: str):
+    db_path_for(store_id)  # validate
+    _current_store.set(store_id)
+
+@contextlib.contextmanager
+def use_store(store_id: str):
+    db_path_for(store_id)  # validate
+    token = _current_store.set(store_id)
+    try:
+        yield
+    finally:
+        _current_store.reset(token)
+
+def store_exists(store_id: str) -> bool:
+    """Valid id of the default store, an allow-listed store or one with a database file."""
+    try:
+        path = db_path_for(store_id)
+    except ValueError:
+        return False
+    return store_id == DEFAULT_STORE or store_id in ALLOWED_STORES or os.path.exists(path)
+
+def list_stores():
+    stores = [DEFAULT_STORE]
+    if os.path.isdir(STORES_DIR):
+        for fname in sorted(os.listdir(STORES_DIR)):
+            sid, ext = os.path.splitext(fname)
+            if ext == '.db' and not sid.endswith('.archive') and _STORE_ID_RE.match(sid):
+                stores.append(sid)
+    return stores
+
+def _connect(path: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if PROFILE_SQL:
+        conn = sqlite3.connect(path, check_same_thread=False, timeout=0, factory=ProfiledConnection)
+        conn.path = path
+        conn.set_progress_handler(conn._tick, PROGRESS_STEPS)
+        conn.set_trace_callback(conn._trace)
+    else:
+        conn = sqlite3.connect(path, check_same_thread=False)
+    # INSERT OR REPLACE must fire delete triggers so the FTS index drops the old row
+    conn.execute("PRAGMA recursive_triggers = ON")
+    # Used by the FTS views/triggers to read compressed text
+    conn.create_function('kirana_unpack', 1, unpack_text, deterministic=True)
+    return conn
+
+class ConnectionPool:
+    """Keeps up to `size` idle connections to one database file for reuse."""
+
+    def __init__(self, path: str, size: int = POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = _connect(self.path)
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+def _pool_for(path: str) -> ConnectionPool:
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(path, ConnectionPool(path))
+    return pool
+
+class _TxConnection:
+    """The transaction's connection as seen by storage functions.
+
+    Their commits wait for the outer block.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def commit(self):
+        pass
+
+def get_connection(store_id: str = None):
+    """Pooled connection for the active (or given) store; commits on clean exit."""
+    path = db_path_for(store_id)
+    tx = _current_tx.get()
+    if tx is not None and tx[0] == path:
+        return contextlib.nullcontext(tx[1])
+    return _pool_for(path).connection()
+
+@contextlib.contextmanager
+def transaction(store_id: str = None):
+    """Make the storage calls inside the block one write transaction with a single commit.
+
+    Rolls everything back if the block raises. Order ids can't be leased inside
+    it (leasing needs its own write lock); take them with reserve_order_ids() first.
+    """
+    path = db_path_for(store_id)
+    tx = _current_tx.get()
+    if tx is not None and tx[0] == path:
+        yield tx[1]
+        return
+    with _pool_for(path).connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        tx_conn = _TxConnection(conn)
+        token = _current_tx.set((path, tx_conn))
+        try:
+            yield tx_conn
+        finally:
+            _current_tx.reset(token)
+
+def fan_out(fn, store_ids=None, max_workers: int = 8) -> dict:
+    """Run fn() once per store in parallel, each inside use_store(); returns {store_id: result}."""
+    store_ids = list(store_ids or list_stores())
+
+    def run(sid):
+        with use_store(sid):
+            return fn()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(store_ids)))) as pool:
+        return dict(zip(store_ids, pool.map(run, store_ids)))
+
+def store_summary() -> dict:
+    with get_connection() as conn:
+        orders, pending, revenue = conn.execute(
+            """SELECT COUNT(*), IFNULL(SUM(status != 'delivered'),0),
+                      IFNULL(SUM(CASE WHEN status='delivered' THEN total_amount END),0)
+               FROM orders"""
+        ).fetchone()
+        messages = conn.execute("SELECT COUNT(*) FROM chat_messages").fetchone()[0]
+    rollups = load_rollups()
+    return {"orders": orders + rollups['order_count'], "pending": pending,
+            "revenue": revenue + rollups['revenue'], "messages": messages, "db_bytes": db_size()}
+
+def all_store_summaries(max_workers: int = 8) -> dict:
+    """Cross-store admin view: one summary per store, queried in parallel."""
+    return fan_out(store_summary, max_workers=max_workers)
+
+# ---------------- Text compression -----------------
+# Long text columns (chat text, unreferenced order text, stored parse results)
+# can be written as raw-deflate BLOBs primed with a preset dictionary of phrases
+# the model repeats in almost every reply. TEXT values are always read as-is,
+# so old rows and compressed rows mix freely. Off unless KIRANA_COMPRESS_TEXT=1.
+# The dictionary is part of the format: add a new version instead of editing it.
+COMPRESS_TEXT = os.getenv('KIRANA_COMPRESS_TEXT', '0') == '1'
+COMPRESS_MIN_BYTES = int(os.getenv('KIRANA_COMPRESS_MIN_BYTES', '64'))
+_ZDICT_V1 = (
+    '{"intent": "order", "items": [{"name": "qty": }], "response_text": "status", '
+    '"greeting", "inventory_check", "unknown", "applied_items", "unavailable", "order_id", '
+    '"__user_text", "reason": "not_found", "only left"'
+    ' packet loaf kilo milk bread rice maggi doodh chawal '
+    'Namaste! Kya chahiye? Aapka order confirm ho gaya hai. Total ₹ Delivery 30 minute mein '
+    'ho jayegi. Theek hai! Order confirmed. Your order will be delivered in 30 minutes. '
+    'Sorry, that item is not available right now. Haan, available hai. Aapka order raaste '
+    'mein hai. Dhanyavaad! Thank you for shopping with us. '
+    'आपका ऑर्डर कन्फर्म हो गया है। कुल ₹ डिलीवरी 30 मिनट में हो जाएगी। धन्यवाद! '
+    'दूध ब्रेड चावल मैगी पैकेट किलो'
+).encode('utf-8')
+_ZDICTS = {b'\x01': _ZDICT_V1}
+_ZVERSION = b'\x01'
+
+def pack_text(text):
+    """Value to store for a long text column.
+
+    A compressed BLOB if compression is enabled and that is smaller, else the text.
+    """
+    if not COMPRESS_TEXT or text is None or len(text) < COMPRESS_MIN_BYTES:
+        return text
+    raw = text.encode('utf-8')
+    comp = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, _ZDICTS[_ZVERSION])
+    packed = _ZVERSION + comp.compress(raw) + comp.flush()
+    return packed if len(packed) < len(raw) else text
+
+def unpack_text(value):
+    """Inverse of pack_text(); plain TEXT and NULL pass through."""
+    if not isinstance(value, bytes):
+        return value
+    decomp = zlib.decompressobj(-15, zdict=_ZDICTS[value[:1]])
+    return (decomp.decompress(value[1:]) + decomp.flush()).decode('utf-8')
 
 def init_db():
     with get_connection() as conn:
         c = conn.cursor()
+        # Only takes effect on a fresh file; compact_db() converts existing ones
+        c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL lets several app processes read while one writes
+        c.execute("PRAGMA journal_mode = WAL")
         c.execute("""
         CREATE TABLE IF NOT EXISTS orders (
             id INTEGER PRIMARY KEY,
@@ -135,7 +541,41 @@ def init_db():
             FOREIGN KEY(order_id) REFERENCES orders(id)
         )
         """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_created "
+                  "ON orders(status, created_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chat_ts ON chat_messages(ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at)")
+        # Orders reference the chat messages holding their request/reply text
+        _add_column(c, 'orders', 'request_msg_id', 'INTEGER NULL')
+        _add_column(c, 'orders', 'response_msg_id', 'INTEGER NULL')
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS id_sequences (
+            name TEXT PRIMARY KEY,
+            next_value INTEGER NOT NULL
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS processed_messages (
+            idem_key TEXT PRIMARY KEY,
+            created_at TEXT,
+            status TEXT,
+            parsed_json TEXT,
+            order_id INTEGER NULL
+        )
+        """)
+        # Set once the assistant reply is in chat_messages, so a replay can tell whether to save it
+        _add_column(c, 'processed_messages', 'reply_msg_id', 'INTEGER NULL')
+        _init_search(c)
+        _init_retention(c)
         conn.commit()
+    _seed_sequence('orders', max_order_id() + 1)
+
+def _add_column(c, table: str, column: str, decl: str):
+    schema, _, name = table.rpartition('.')
+    cols = {r[1] for r in c.execute(f"PRAGMA {schema or 'main'}.table_info({name})")}
+    if column not in cols:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
 
 def start_order_worker():
     global _order_thread_started
@@ -164,14 +604,15 @@ def _persist_order(order_data: dict):
     with get_connection() as conn:
         c = conn.cursor()
         c.execute(
-            "INSERT OR REPLACE INTO orders (id, created_at, status, total_amount, raw_request, response_text, items_json) VALUES (?,?,?,?,?,?,?)",
+            "INSERT INTO orders (id, created_at, status, total_amount, raw_request, response_text, "
+            "items_json) VALUES (?,?,?,?,?,?,?)",
             (
                 order_data['id'],
                 order_data['created_at'],
                 order_data['status'],
                 order_data['total_amount'],
-                order_data.get('raw_request',''),
-                order_data.get('response_text',''),
+                pack_text(order_data.get('raw_request','')),
+                pack_text(order_data.get('response_text','')),
                 json.dumps(order_data['items'])
             )
         )
@@ -181,25 +622,71 @@ def _persist_order(order_data: dict):
             up = item['unit_price']
             lt = item['line_total']
             c.execute(
-                "INSERT INTO order_items (order_id, item_name, qty, unit_price, line_total) VALUES (?,?,?,?,?)",
+                "INSERT INTO order_items (order_id, item_name, qty, unit_price, line_total) "
+                "VALUES (?,?,?,?,?)",
                 (order_data['id'], name, qty, up, lt)
             )
         conn.commit()
 
+def save_order(order_id: int, status: str, items: list, raw_request: str, response_text: str,
+               total: float, request_msg_id: int = None):
+    # With request_msg_id the request text lives only in chat_messages; the
+    # reply is linked the same way when save_chat() stores it with this order_id
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT INTO orders (id, created_at, status, total_amount, items_json, raw_request, "
+            "response_text, request_msg_id) VALUES (?,?,?,?,?,?,?,?)",
+            (order_id, datetime.utcnow().isoformat(), status, total, json.dumps(items),
+             None if request_msg_id else pack_text(raw_request), pack_text(response_text),
+             request_msg_id)
+        )
+        conn.executemany(
+            "INSERT INTO order_items (order_id, item_name, qty, unit_price, line_total) "
+            "VALUES (?,?,?,?,?)",
+            [(order_id, i['name'], i['qty'], i.get('unit_price'), i.get('line_total'))
+             for i in items]
+        )
+        if request_msg_id:
+            conn.execute("UPDATE chat_messages SET order_id=? WHERE id=? AND order_id IS NULL",
+                         (order_id, request_msg_id))
+        conn.commit()
+
 def update_order_status(order_id: int, new_status: str):
     with get_connection() as conn:
         c = conn.cursor()
         c.execute("UPDATE orders SET status=? WHERE id=?", (new_status, order_id))
         conn.commit()
 
-def save_chat(role: str, text: str, order_id=None):
+def save_chat(role: str, text: str, order_id=None) -> int:
+    """Store a chat message and return its id.
+
+    An assistant message for an order becomes that order's reply, replacing the
+    copy save_order() kept until then.
+    """
     with get_connection() as conn:
         c = conn.cursor()
         c.execute(
             "INSERT INTO chat_messages (ts, role, text, order_id) VALUES (?,?,?,?)",
-            (datetime.utcnow().isoformat(), role, text, order_id)
+            (datetime.utcnow().isoformat(), role, pack_text(text), order_id)
         )
+        msg_id = c.lastrowid
+        if order_id and role == 'assistant':
+            c.execute("UPDATE orders SET response_msg_id=?, response_text=NULL "
+                      "WHERE id=? AND response_msg_id IS NULL", (msg_id, order_id))
         conn.commit()
+    return msg_id
+
+def load_chat(limit: int = 200):
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT ts, role, text, IFNULL(order_id,'') FROM chat_messages "
+            "ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+    messages = []
+    for ts, role, text, oid in rows:
+        messages.append({"ts": ts, "role": role, "text": unpack_text(text),
+                         "order_id": oid if oid != '' else None})
+    return list(reversed(messages))
 
 def load_orders():
     with get_connection() as conn:
@@ -219,3 +706,651 @@ def load_orders():
 
 def price_for_item(name: str) -> float:
     return PRICES.get(name, 10.0)
+
+# ---------------- Full-text search (FTS5) -----------------
+# External-content FTS5 tables index chat text and order requests without
+# duplicating the text; triggers keep them in sync with the base tables.
+# With KIRANA_COMPRESS_TEXT the content side is a view running kirana_unpack()
+# instead, so compressed rows are indexed and snippeted as plain text. That
+# function only exists on storage.py connections, so the plain layout is kept
+# whenever nothing is compressed and other writers keep working. Orders whose
+# request is a chat message (request_msg_id) have no text of their own and are
+# found through chat_fts.
+# Around matched terms in search() snippets; control characters can't clash with message text
+SNIPPET_OPEN, SNIPPET_CLOSE = '\x02', '\x03'
+# unicode61 treats Devanagari vowel signs, virama and nukta as separators ('दूध' -> 'द', 'ध');
+# declaring them token characters keeps Hindi words whole
+_DEVANAGARI_MARKS = ''.join(chr(c)
+                            for lo, hi in ((0x900, 0x903), (0x93A, 0x94F), (0x951, 0x957),
+                                           (0x962, 0x963))
+                            for c in range(lo, hi + 1))
+_FTS_TOKENIZE = f"unicode61 tokenchars '{_DEVANAGARI_MARKS}'"
+_FTS_TRIGGERS = ['chat_fts_ai', 'chat_fts_ad', 'chat_fts_au',
+                 'orders_fts_ai', 'orders_fts_ad', 'orders_fts_au']
+
+def _fts_unpacks(c, existing: dict) -> bool:
+    if COMPRESS_TEXT:
+        return True
+    if "'chat_messages_text'" not in existing.get('chat_fts', ''):
+        return False
+    # Compression was on before: stay on the unpacking layout while compressed rows remain
+    return bool(c.execute(
+        """SELECT EXISTS(SELECT 1 FROM chat_messages WHERE typeof(text) = 'blob')
+                  OR EXISTS(SELECT 1 FROM orders WHERE typeof(raw_request) = 'blob')"""
+    ).fetchone()[0])
+
+def _init_search(c):
+    existing = dict(c.execute("SELECT name, sql FROM sqlite_master WHERE type='table'").fetchall())
+    unpack = _fts_unpacks(c, existing)
+    if unpack:
+        chat_src, orders_src = 'chat_messages_text', 'orders_text'
+    else:
+        chat_src, orders_src = 'chat_messages', 'orders'
+    col = 'kirana_unpack({})'.format if unpack else str
+    # An index built for the other layout or an older tokenizer is rebuilt
+    stale = [t for t, src in (('chat_fts', chat_src), ('orders_fts', orders_src))
+             if t in existing
+             and (f"content='{src}'" not in existing[t] or _FTS_TOKENIZE not in existing[t])]
+    for t in stale:
+        c.execute(f"DROP TABLE {t}")
+        del existing[t]
+    if stale:
+        for trig in _FTS_TRIGGERS:
+            c.execute(f"DROP TRIGGER IF EXISTS {trig}")
+    if unpack:
+        c.execute("CREATE VIEW IF NOT EXISTS chat_messages_text AS "
+                  "SELECT id, kirana_unpack(text) AS text FROM chat_messages")
+        c.execute("CREATE VIEW IF NOT EXISTS orders_text AS "
+                  "SELECT id, kirana_unpack(raw_request) AS raw_request FROM orders")
+    else:
+        c.execute("DROP VIEW IF EXISTS chat_messages_text")
+        c.execute("DROP VIEW IF EXISTS orders_text")
+    c.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5(
+        text, content='{chat_src}', content_rowid='id', tokenize="{_FTS_TOKENIZE}"
+    )""")
+    c.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+        raw_request, content='{orders_src}', content_rowid='id', tokenize="{_FTS_TOKENIZE}"
+    )""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS chat_fts_ai AFTER INSERT ON chat_messages BEGIN
+        INSERT INTO chat_fts(rowid, text) VALUES (new.id, {col('new.text')});
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS chat_fts_ad AFTER DELETE ON chat_messages BEGIN
+        INSERT INTO chat_fts(chat_fts, rowid, text) VALUES ('delete', old.id, {col('old.text')});
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS chat_fts_au AFTER UPDATE OF text ON chat_messages
+    BEGIN
+        INSERT INTO chat_fts(chat_fts, rowid, text) VALUES ('delete', old.id, {col('old.text')});
+        INSERT INTO chat_fts(rowid, text) VALUES (new.id, {col('new.text')});
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS orders_fts_ai AFTER INSERT ON orders BEGIN
+        INSERT INTO orders_fts(rowid, raw_request) VALUES (new.id, {col('new.raw_request')});
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS orders_fts_ad AFTER DELETE ON orders BEGIN
+        INSERT INTO orders_fts(orders_fts, rowid, raw_request)
+        VALUES ('delete', old.id, {col('old.raw_request')});
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS orders_fts_au AFTER UPDATE OF raw_request ON orders
+    BEGIN
+        INSERT INTO orders_fts(orders_fts, rowid, raw_request)
+        VALUES ('delete', old.id, {col('old.raw_request')});
+        INSERT INTO orders_fts(rowid, raw_request) VALUES (new.id, {col('new.raw_request')});
+    END""")
+    # Backfill rows written before the index existed
+    if 'chat_fts' not in existing:
+        c.execute("INSERT INTO chat_fts(chat_fts) VALUES ('rebuild')")
+    if 'orders_fts' not in existing:
+        c.execute("INSERT INTO orders_fts(orders_fts) VALUES ('rebuild')")
+
+def _fts_query(text:str) -> str:
+    # Quote every token so user input can't break FTS5 syntax; last token is a prefix match
+    tokens = [t.replace('"', '') for t in text.split()]
+    tokens = [t for t in tokens if t]
+    if not tokens:
+        return ''
+    quoted = [f'"{t}"' for t in tokens]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+def search(query:str, limit:int=20):
+    """Ranked full-text search over chat messages and order requests (best match first)."""
+    match = _fts_query(query)
+    if not match:
+        return []
+    with get_connection() as conn:
+        chat_rows = conn.execute(
+            """SELECT m.id, m.ts, m.role, m.order_id, snippet(chat_fts, 0, ?, ?, '…', 12),
+                      bm25(chat_fts)
+               FROM chat_fts JOIN chat_messages m ON m.id = chat_fts.rowid
+               WHERE chat_fts MATCH ? ORDER BY bm25(chat_fts) LIMIT ?""",
+            (SNIPPET_OPEN, SNIPPET_CLOSE, match, limit)).fetchall()
+        order_rows = conn.execute(
+            """SELECT o.id, o.created_at, o.status, o.id, snippet(orders_fts, 0, ?, ?, '…', 12),
+                      bm25(orders_fts)
+               FROM orders_fts JOIN orders o ON o.id = orders_fts.rowid
+               WHERE orders_fts MATCH ? ORDER BY bm25(orders_fts) LIMIT ?""",
+            (SNIPPET_OPEN, SNIPPET_CLOSE, match, limit)).fetchall()
+    chat = [{"source": "chat", "id": rid, "ts": ts, "role": role, "order_id": oid, "snippet": snip,
+             "rank": rank}
+            for rid, ts, role, oid, snip, rank in chat_rows]
+    orders = [{"source": "order", "id": rid, "ts": ts, "status": status, "order_id": oid,
+               "snippet": snip, "rank": rank}
+              for rid, ts, status, oid, snip, rank in order_rows]
+    # Each index's bm25() uses its own corpus statistics, so scores can't be compared
+    # across the two; alternate between the two ranked lists instead
+    results = [r for pair in itertools.zip_longest(chat, orders) for r in pair if r is not None]
+    return results[:limit]
+
+# ---------------- Retention: archival, rollups, compaction -----------------
+# Delivered orders and chat older than RETENTION_DAYS move out of the hot tables
+# into *_archive tables, either in data.db or in a separate ARCHIVE_DB_PATH file.
+# Archived orders are folded into order_rollups/item_rollups first, so revenue
+# and stock totals survive the move.
+RETENTION_DAYS = int(os.getenv('KIRANA_RETENTION_DAYS', '30'))
+ARCHIVE_DB_PATH = os.getenv('KIRANA_ARCHIVE_DB') or None
+RETENTION_INTERVAL_SECONDS = int(os.getenv('KIRANA_RETENTION_INTERVAL', '3600'))
+ARCHIVE_BATCH_SIZE = 5000
+
+_retention_thread_started = False
+
+def _init_retention(c):
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS order_rollups (
+        day TEXT PRIMARY KEY,
+        order_count INTEGER,
+        revenue REAL
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS item_rollups (
+        item_name TEXT PRIMARY KEY,
+        qty INTEGER,
+        revenue REAL
+    )
+    """)
+
+def _init_archive_tables(c, schema: str):
+    c.execute(f"""
+    CREATE TABLE IF NOT EXISTS {schema}.orders_archive (
+        id INTEGER PRIMARY KEY,
+        created_at TEXT,
+        status TEXT,
+        total_amount REAL,
+        raw_request TEXT,
+        response_text TEXT,
+        items_json TEXT,
+        archived_at TEXT,
+        request_msg_id INTEGER NULL,
+        response_msg_id INTEGER NULL
+    )
+    """)
+    _add_column(c, f"{schema}.orders_archive", 'request_msg_id', 'INTEGER NULL')
+    _add_column(c, f"{schema}.orders_archive", 'response_msg_id', 'INTEGER NULL')
+    c.execute(f"""
+    CREATE TABLE IF NOT EXISTS {schema}.order_items_archive (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER,
+        item_name TEXT,
+        qty INTEGER,
+        unit_price REAL,
+        line_total REAL
+    )
+    """)
+    c.execute(f"""
+    CREATE TABLE IF NOT EXISTS {schema}.chat_messages_archive (
+        id INTEGER PRIMARY KEY,
+        ts TEXT,
+        role TEXT,
+        text TEXT,
+        order_id INTEGER NULL,
+        archived_at TEXT
+    )
+    """)
+
+def archive_path_for(store_id: str = None):
+    if not ARCHIVE_DB_PATH:
+        return None
+    store_id = store_id or current_store()
+    if store_id == DEFAULT_STORE:
+        return ARCHIVE_DB_PATH
+    return os.path.join(STORES_DIR, f"{store_id}.archive.db")
+
+def db_size(path: str = None) -> int:
+    path = path or db_path_for()
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def compact_db(max_pages: int = None) -> int:
+    """Release free pages back to the filesystem; returns bytes reclaimed."""
+    before = db_size()
+    conn = _connect(db_path_for())
+    try:
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode != 2:
+            # One-off full VACUUM switches an existing file to incremental mode
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        elif max_pages:
+            conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+        else:
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+    finally:
+        conn.close()
+    return before - db_size()
+
+def _archive_batch(c, schema: str, cutoff: str, now: str) -> int:
+    rows = c.execute(
+        "SELECT id, created_at, total_amount, items_json FROM orders "
+        "WHERE status='delivered' AND created_at < ? ORDER BY id LIMIT ?",
+        (cutoff, ARCHIVE_BATCH_SIZE)
+    ).fetchall()
+    if not rows:
+        return 0
+    days = {}
+    item_totals = {}
+    for _oid, created_at, total, items_json in rows:
+        day = (created_at or '')[:10]
+        count, revenue = days.get(day, (0, 0.0))
+        days[day] = (count + 1, revenue + (total or 0.0))
+        try:
+            items = json.loads(items_json) if items_json else []
+        except Exception:
+            items = []
+        for i in items:
+            qty, revenue = item_totals.get(i['name'], (0, 0.0))
+            line_total = i.get('line_total') or price_for_item(i['name']) * i['qty']
+            item_totals[i['name']] = (qty + i['qty'], revenue + line_total)
+    c.executemany(
+        """INSERT INTO order_rollups (day, order_count, revenue) VALUES (?,?,?)
+           ON CONFLICT(day) DO UPDATE SET order_count=order_count+excluded.order_count,
+                                          revenue=revenue+excluded.revenue""",
+        [(d, n, r) for d, (n, r) in days.items()]
+    )
+    c.executemany(
+        """INSERT INTO item_rollups (item_name, qty, revenue) VALUES (?,?,?)
+           ON CONFLICT(item_name) DO UPDATE SET qty=qty+excluded.qty,
+                                                revenue=revenue+excluded.revenue""",
+        [(n, q, r) for n, (q, r) in item_totals.items()]
+    )
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS _archive_ids (id INTEGER PRIMARY KEY)")
+    c.execute("DELETE FROM _archive_ids")
+    c.executemany("INSERT INTO _archive_ids (id) VALUES (?)", [(r[0],) for r in rows])
+    c.execute(
+        f"""INSERT OR REPLACE INTO {schema}.orders_archive
+                (id, created_at, status, total_amount, raw_request, response_text, items_json,
+                 archived_at, request_msg_id, response_msg_id)
+            SELECT id, created_at, status, total_amount, raw_request, response_text, items_json, ?,
+                   request_msg_id, response_msg_id
+            FROM orders WHERE id IN (SELECT id FROM _archive_ids)""", (now,)
+    )
+    c.execute(
+        f"""INSERT OR REPLACE INTO {schema}.order_items_archive
+            SELECT id, order_id, item_name, qty, unit_price, line_total
+            FROM order_items WHERE order_id IN (SELECT id FROM _archive_ids)"""
+    )
+    c.execute("DELETE FROM order_items WHERE order_id IN (SELECT id FROM _archive_ids)")
+    c.execute("DELETE FROM orders WHERE id IN (SELECT id FROM _archive_ids)")
+    return len(rows)
+
+def archive_old_data(max_age_days: int = None, archive_path: str = None,
+                     vacuum: bool = True) -> dict:
+    """Move delivered orders and chat older than max_age_days out of the hot tables.
+
+    Works in batches of ARCHIVE_BATCH_SIZE, one transaction each, so the app is
+    never locked out for long. Returns counts and database size before/after.
+    """
+    max_age_days = RETENTION_DAYS if max_age_days is None else max_age_days
+    archive_path = archive_path or archive_path_for()
+    cutoff = (datetime.utcnow() - timedelta(days=max_age_days)).isoformat()
+    now = datetime.utcnow().isoformat()
+    report = {"cutoff": cutoff, "orders_archived": 0, "chat_archived": 0,
+              "size_before": db_size(), "archive_path": archive_path or db_path_for()}
+    conn = _connect(db_path_for())
+    try:
+        schema = 'main'
+        if archive_path:
+            conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+            schema = 'archive'
+        c = conn.cursor()
+        _init_archive_tables(c, schema)
+        conn.commit()
+        while True:
+            moved = _archive_batch(c, schema, cutoff, now)
+            conn.commit()
+            report['orders_archived'] += moved
+            if moved < ARCHIVE_BATCH_SIZE:
+                break
+        # Messages of orders still in the hot table stay, since those orders
+        # read their text from them
+        old_chat = """SELECT id FROM chat_messages WHERE ts < ?
+                       AND (order_id IS NULL OR order_id NOT IN (SELECT id FROM orders))
+                       ORDER BY id LIMIT ?"""
+        while True:
+            c.execute(
+                f"""INSERT OR REPLACE INTO {schema}.chat_messages_archive
+                    SELECT id, ts, role, text, order_id, ? FROM chat_messages
+                    WHERE id IN ({old_chat})""",
+                (now, cutoff, ARCHIVE_BATCH_SIZE)
+            )
+            moved = c.execute(
+                f"DELETE FROM chat_messages WHERE id IN ({old_chat})",
+                (cutoff, ARCHIVE_BATCH_SIZE)
+            ).rowcount
+            conn.commit()
+            report['chat_archived'] += moved
+            if moved < ARCHIVE_BATCH_SIZE:
+                break
+        conn.execute("DELETE FROM processed_messages WHERE created_at < ?", (cutoff,))
+        conn.commit()
+        if archive_path:
+            conn.execute("DETACH DATABASE archive")
+    finally:
+        conn.close()
+    if vacuum:
+        compact_db()
+    report['size_after'] = db_size()
+    return report
+
+def load_rollups() -> dict:
+    """Totals for archived orders: count, revenue and quantity sold per item."""
+    with get_connection() as conn:
+        order_count, revenue = conn.execute(
+            "SELECT IFNULL(SUM(order_count),0), IFNULL(SUM(revenue),0) FROM order_rollups"
+        ).fetchone()
+        items = dict(conn.execute("SELECT item_name, qty FROM item_rollups").fetchall())
+    return {"order_count": order_count, "revenue": revenue, "items": items}
+
+def max_order_id() -> int:
+    """Highest order id ever issued, including archived orders."""
+    with get_connection() as conn:
+        ids = [conn.execute("SELECT IFNULL(MAX(id),0) FROM orders").fetchone()[0]]
+        has_archive = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='orders_archive'"
+        ).fetchone()
+        if has_archive:
+            ids.append(conn.execute("SELECT IFNULL(MAX(id),0) FROM orders_archive").fetchone()[0])
+    archive_path = archive_path_for()
+    if archive_path and os.path.exists(archive_path):
+        arch = sqlite3.connect(archive_path)
+        try:
+            ids.append(arch.execute("SELECT IFNULL(MAX(id),0) FROM orders_archive").fetchone()[0])
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            arch.close()
+    return max(ids)
+
+def start_retention_worker(interval_seconds: int = None):
+    global _retention_thread_started
+    with _lock:
+        if _retention_thread_started:
+            return
+        t = threading.Thread(target=_retention_worker,
+                             args=(interval_seconds or RETENTION_INTERVAL_SECONDS,),
+                             daemon=True, name='RetentionThread')
+        t.start()
+        _retention_thread_started = True
+
+def _retention_worker(interval_seconds: int):
+    while True:
+        time.sleep(interval_seconds)
+        for store_id in list_stores():
+            try:
+                with use_store(store_id):
+                    archive_old_data()
+            except Exception:
+                # In production, log properly
+                pass
+
+# ---------------- Order ID allocation (hi-lo) -----------------
+# Each process leases a block of ids from the store's id_sequences row in one short
+# write transaction, then hands them out from memory. Sessions and processes
+# sharing data.db never see the same id; unused ids in a block are skipped
+# when the process exits, so ids are unique but not gap-free.
+ID_BLOCK_SIZE = int(os.getenv('KIRANA_ID_BLOCK_SIZE', '50'))
+
+def _seed_sequence(name: str, start: int):
+    with get_connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO id_sequences (name, next_value) VALUES (?,?)",
+                     (name, start))
+        # Rows written before the sequence existed (or by older code) must not be reissued
+        conn.execute("UPDATE id_sequences SET next_value = MAX(next_value, ?) WHERE name = ?",
+                     (start, name))
+        conn.commit()
+
+def lease_id_block(name: str, size: int) -> range:
+    conn = _connect(db_path_for())
+    conn.isolation_level = None
+    try:
+        # IMMEDIATE takes the write lock up front, so concurrent leases serialize
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT next_value FROM id_sequences WHERE name = ?", (name,)).fetchone()
+        start = row[0] if row else 1
+        conn.execute("INSERT OR REPLACE INTO id_sequences (name, next_value) VALUES (?,?)",
+                     (name, start + size))
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return range(start, start + size)
+
+class IdAllocator:
+    def __init__(self, name: str, block_size: int = ID_BLOCK_SIZE):
+        self.name = name
+        self.block_size = block_size
+        self._blocks = {}  # db path -> [next id, end of leased block]
+        self._lock = threading.Lock()
+
+    def _block(self, path: str, needed: int):
+        block = self._blocks.get(path)
+        if block is None or block[1] - block[0] < needed:
+            leased = lease_id_block(self.name, max(self.block_size, needed))
+            block = self._blocks[path] = [leased.start, leased.stop]
+        return block
+
+    def next_id(self) -> int:
+        # Blocks are per database file: each store has its own sequence
+        with self._lock:
+            block = self._block(db_path_for(), 1)
+            value = block[0]
+            block[0] += 1
+            return value
+
+    def reserve(self, count: int) -> list:
+        """Take `count` ids now for this caller; using them later commits nothing."""
+        if count <= 0:
+            return []
+        with self._lock:
+            block = self._block(db_path_for(), count)
+            ids = list(range(block[0], block[0] + count))
+            block[0] += count
+            return ids
+
+_order_ids = IdAllocator('orders')
+
+def allocate_order_id() -> int:
+    return _order_ids.next_id()
+
+def reserve_order_ids(count: int) -> list:
+    return _order_ids.reserve(count)
+
+# ---------------- Idempotent message processing -----------------
+# One row per client message key. The first caller claims the key ('pending'),
+# runs the model and stores the parsed result ('done'); retries and double
+# submits with the same key get the stored result instead of a second LLM call.
+IDEMPOTENCY_WAIT_SECONDS = 30.0
+
+_MESSAGE_SELECT = ("SELECT status, parsed_json, order_id, created_at, reply_msg_id "
+                   "FROM processed_messages WHERE idem_key=?")
+
+def _message_row(row):
+    if row is None:
+        return None
+    status, parsed_json, order_id, created_at, reply_msg_id = row
+    try:
+        parsed = json.loads(unpack_text(parsed_json)) if parsed_json else None
+    except Exception:
+        parsed = None
+    return {"status": status, "parsed": parsed, "order_id": order_id, "created_at": created_at,
+            "reply_msg_id": reply_msg_id}
+
+def lookup_message(idem_key: str):
+    with get_connection() as conn:
+        row = conn.execute(
+            _MESSAGE_SELECT, (idem_key,)
+        ).fetchone()
+    return _message_row(row)
+
+def claim_message(idem_key: str):
+    """Claim a message key. Returns None if the caller now owns it, else the existing record."""
+    with get_connection() as conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO processed_messages (idem_key, created_at, status) "
+            "VALUES (?,?,'pending')",
+            (idem_key, datetime.utcnow().isoformat())
+        )
+        conn.commit()
+        if cur.rowcount == 1:
+            return None
+        row = conn.execute(
+            _MESSAGE_SELECT, (idem_key,)
+        ).fetchone()
+    return _message_row(row)
+
+def complete_message(idem_key: str, parsed: dict, order_id=None):
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE processed_messages SET status='done', parsed_json=?, order_id=? "
+            "WHERE idem_key=?",
+            (pack_text(json.dumps(parsed, ensure_ascii=False)), order_id, idem_key)
+        )
+        conn.commit()
+
+def record_reply(idem_key: str, reply_msg_id: int):
+    """Note the chat_messages id of the assistant reply saved for a completed key."""
+    with get_connection() as conn:
+        conn.execute("UPDATE processed_messages SET reply_msg_id=? WHERE idem_key=?",
+                     (reply_msg_id, idem_key))
+        conn.commit()
+
+def release_message(idem_key: str):
+    with get_connection() as conn:
+        conn.execute("DELETE FROM processed_messages WHERE idem_key=? AND status='pending'",
+                     (idem_key,))
+        conn.commit()
+
+def wait_for_message(idem_key: str, timeout: float = IDEMPOTENCY_WAIT_SECONDS, poll: float = 0.1):
+    """Wait for another worker to finish a claimed key; None if it never does."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        record = lookup_message(idem_key)
+        if record is None or record['status'] == 'done':
+            return record
+        time.sleep(poll)
+    return None
+
+# ---------------- Bulk export / import -----------------
+# Column order is fixed so exports from any store import into any other.
+# Tables are listed in dependency order (orders before the rows pointing at
+# them); rows are read in order of the first column, the table's key.
+EXPORT_TABLES = {
+    'orders': ['id', 'created_at', 'status', 'total_amount', 'raw_request', 'response_text',
+               'items_json', 'request_msg_id', 'response_msg_id'],
+    'order_items': ['id', 'order_id', 'item_name', 'qty', 'unit_price', 'line_total'],
+    'chat_messages': ['id', 'ts', 'role', 'text', 'order_id'],
+    'orders_archive': ['id', 'created_at', 'status', 'total_amount', 'raw_request',
+                       'response_text', 'items_json', 'archived_at', 'request_msg_id',
+                       'response_msg_id'],
+    'order_items_archive': ['id', 'order_id', 'item_name', 'qty', 'unit_price', 'line_total'],
+    'chat_messages_archive': ['id', 'ts', 'role', 'text', 'order_id', 'archived_at'],
+    'order_rollups': ['day', 'order_count', 'revenue'],
+    'item_rollups': ['item_name', 'qty', 'revenue'],
+}
+# These live in the ARCHIVE_DB_PATH file when one is configured
+ARCHIVE_TABLES = {'orders_archive', 'order_items_archive', 'chat_messages_archive'}
+# Exports always carry plain text, even for compressed rows
+EXPORT_PACKED = {'raw_request', 'response_text', 'text'}
+EXPORT_BATCH_SIZE = 5000
+IMPORT_COMMIT_ROWS = 200000
+
+@contextlib.contextmanager
+def _table_schema(conn, table: str, create: bool = False):
+    """Schema of conn holding an export table, attaching the archive file if needed.
+
+    Yields None for archive tables that don't exist yet, unless create is set.
+    """
+    if table not in ARCHIVE_TABLES:
+        yield 'main'
+        return
+    path = archive_path_for()
+    if path and not create and not os.path.exists(path):
+        yield None
+        return
+    schema = 'main'
+    if path:
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        schema = 'archive'
+    try:
+        if create:
+            _init_archive_tables(conn, schema)
+            conn.commit()
+        elif not conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' AND name=?",
+                              (table,)).fetchone():
+            schema = None
+        yield schema
+    finally:
+        if path:
+            conn.execute("DETACH DATABASE archive")
+
+def iter_table(table: str, batch_size: int = EXPORT_BATCH_SIZE):
+    """Yield rows of an exportable table in key order, batch_size rows at a time."""
+    cols = EXPORT_TABLES[table]
+    select = ', '.join(f"kirana_unpack({c})" if c in EXPORT_PACKED else c for c in cols)
+    with get_connection() as conn, _table_schema(conn, table) as schema:
+        if schema is None:
+            return
+        cur = conn.execute(f"SELECT {select} FROM {schema}.{table} ORDER BY {cols[0]}")
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+def import_rows(table: str, batches, skip_existing: bool = False,
+                commit_rows: int = IMPORT_COMMIT_ROWS) -> int:
+    """Insert batches of rows (in EXPORT_TABLES column order); commits every commit_rows rows."""
+    cols = EXPORT_TABLES[table]
+    verb = "INSERT OR IGNORE" if skip_existing else "INSERT"
+    total = 0
+    pending = 0
+    with get_connection() as conn, _table_schema(conn, table, create=True) as schema:
+        placeholders = ', '.join('?' for _ in cols)
+        sql = f"{verb} INTO {schema}.{table} ({', '.join(cols)}) VALUES ({placeholders})"
+        for rows in batches:
+            conn.executemany(sql, rows)
+            total += len(rows)
+            pending += len(rows)
+            if pending >= commit_rows:
+                conn.commit()
+                pending = 0
+        conn.commit()
+    if table in ('orders', 'orders_archive'):
+        # Imported ids must never be handed out again
+        _seed_sequence('orders', max_order_id() + 1)
+    return total
+
+# ---------------- Consumption history -----------------
+def consumption_history(days: int, now: datetime = None):
+    """(item_name, age_in_days, qty) sold per item per day over the last `days` days."""
+    now = now or datetime.utcnow()
+    since = (now - timedelta(days=days)).isoformat()
+    with get_connection() as conn:
+        return conn.execute(
+            """SELECT oi.item_name, CAST(julianday(?) - julianday(o.created_at) AS INTEGER) AS age,
+                      SUM(oi.qty)
+               FROM orders o JOIN order_items oi ON oi.order_id = o.id
+               WHERE o.created_at >= ?
+               GROUP BY oi.item_name, age""",
+            (now.isoformat(), since),
+        ).fetchall()
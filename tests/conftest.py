@@ -0,0 +1,47 @@
+import types
+
+import pytest
+
+import agent
+import storage
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A fresh default-store database in tmp_path, with no archive file and no slow-query log."""
+    monkeypatch.setattr(storage, 'DB_PATH', str(tmp_path / 'data.db'))
+    monkeypatch.setattr(storage, 'STORES_DIR', str(tmp_path / 'stores'))
+    monkeypatch.setattr(storage, 'ARCHIVE_DB_PATH', None)
+    monkeypatch.setattr(storage, 'SLOW_QUERY_LOG', '')
+    storage.init_db()
+    return tmp_path
+
+
+@pytest.fixture
+def session(store):
+    """Per-session state as app.py keeps it, loaded from the test store."""
+    state = types.SimpleNamespace(store_id=storage.DEFAULT_STORE, orders=[], inventory=None)
+    agent.recompute_inventory_from_orders(state)
+    return state
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    """Replace the model with canned replies: texts starting with 'order' order one milk.
+
+    Returns the list of texts the model was asked to parse.
+    """
+    calls = []
+
+    def fake_parse(state, model, user_text):
+        calls.append(user_text)
+        if user_text.startswith('order'):
+            return {'intent': 'order', 'items': [{'name': 'milk', 'qty': 1}],
+                    'response_text': 'ok'}
+        if user_text.startswith('hello'):
+            return {'intent': 'greeting', 'items': [], 'response_text': 'hi'}
+        return {'intent': 'unknown', 'items': [], 'response_text': 'Parsing error'}
+
+    monkeypatch.setattr(agent, 'gemini_parse', fake_parse)
+    monkeypatch.setattr(agent, 'get_graph', lambda: None)
+    return calls
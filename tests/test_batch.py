@@ -0,0 +1,57 @@
+import pytest
+
+import agent
+import storage
+
+
+def _batch(*texts, keys=None):
+    keys = keys or [None] * len(texts)
+    return [{'id': i, 'text': t, 'idempotency_key': k}
+            for i, (t, k) in enumerate(zip(texts, keys), 1)]
+
+
+def test_each_message_gets_its_result(session, parses):
+    results = agent.process_user_messages(session, None,
+                                          _batch('order milk', 'hello', 'order milk'))
+    assert [results[i]['intent'] for i in (1, 2, 3)] == ['order', 'greeting', 'order']
+    order_ids = [results[1]['order_id'], results[3]['order_id']]
+    assert sorted(o['id'] for o in storage.load_orders()) == sorted(order_ids)
+    assert session.inventory['milk'] == agent.INVENTORY['milk']['qty'] - 2
+
+
+def test_repeated_key_in_a_batch_is_processed_once(session, parses):
+    results = agent.process_user_messages(
+        session, None, _batch('order milk', 'order milk', keys=['k', 'k']))
+    assert parses == ['order milk']
+    assert results[2]['__replayed'] and not results[1].get('__replayed')
+    assert results[2]['order_id'] == results[1]['order_id']
+    assert len(storage.load_orders()) == 1
+
+
+def test_keys_done_earlier_are_replayed(session, parses):
+    agent.process_user_message(session, None, 'order milk', idempotency_key='k')
+    results = agent.process_user_messages(session, None,
+                                          _batch('order milk', 'hello', keys=['k', 'h']))
+    assert parses == ['order milk', 'hello']
+    assert results[1]['__replayed']
+    assert len(storage.load_orders()) == 1
+
+
+def test_failed_batch_writes_nothing(session, parses, monkeypatch):
+    save_order = agent.save_order
+    saved = []
+
+    def fail_second(*args):
+        if saved:
+            raise RuntimeError('disk full')
+        saved.append(args[0])
+        save_order(*args)
+
+    monkeypatch.setattr(agent, 'save_order', fail_second)
+    inventory = dict(session.inventory)
+    with pytest.raises(RuntimeError):
+        agent.process_user_messages(session, None,
+                                    _batch('order milk', 'order milk', keys=['a', 'b']))
+    assert storage.load_orders() == []
+    assert session.inventory == inventory and session.orders == []
+    assert storage.lookup_message('a') is None and storage.lookup_message('b') is None
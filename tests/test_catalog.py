@@ -0,0 +1,60 @@
+import agent
+from catalog import Catalog
+
+ITEMS = {
+    'sunflower oil': {'qty': 6, 'unit': 'litre', 'price': 160.0, 'aliases': ['refined oil']},
+    'mustard oil': {'qty': 4, 'unit': 'litre', 'price': 180.0, 'hindi': ['sarson tel']},
+    'basmati rice': {'qty': 20, 'unit': 'kilo', 'price': 120.0, 'hindi': ['chawal']},
+    'milk': {'qty': 10, 'unit': 'packet', 'price': 25.0, 'low_stock': 3},
+}
+
+
+def _big_catalog(n=5000):
+    items = {f'brand{i} biscuit': {'qty': 1, 'unit': 'packet', 'price': 10.0} for i in range(n)}
+    return Catalog({**items, **ITEMS})
+
+
+def test_behaves_like_the_dict_it_was_built_from():
+    catalog = Catalog(ITEMS)
+    assert dict(catalog) == ITEMS
+    assert list(catalog) == list(ITEMS)
+    assert 'milk' in catalog and 'bread' not in catalog
+    assert catalog.get('bread') is None
+    assert catalog.opening_stock() == {name: info['qty'] for name, info in ITEMS.items()}
+    assert dict(Catalog(agent.INVENTORY)) == agent.INVENTORY
+
+
+def test_from_dict_keeps_an_existing_catalog():
+    catalog = Catalog(ITEMS)
+    assert Catalog.from_dict(catalog) is catalog
+    assert isinstance(Catalog.from_dict(ITEMS), Catalog)
+
+
+def test_search_ranks_by_rare_terms():
+    catalog = Catalog(ITEMS)
+    assert catalog.search('sunflower oil chahiye')[0] == 'sunflower oil'
+    assert set(catalog.search('oil')) == {'sunflower oil', 'mustard oil'}
+    assert catalog.search('sarson ka tel') == ['mustard oil']
+    assert catalog.search('do kilo chawal') == ['basmati rice']
+    assert catalog.search('nothing here') == []
+
+
+def test_search_corrects_misspellings():
+    catalog = Catalog(ITEMS)
+    assert catalog.search('sunflowr')[0] == 'sunflower oil'
+    assert catalog.search('basmti')[0] == 'basmati rice'
+
+
+def test_search_in_a_large_catalog_returns_at_most_k():
+    catalog = _big_catalog()
+    assert catalog.search('refined oil', k=5)[0] == 'sunflower oil'
+    assert len(catalog.search('biscuit', k=7)) == 7
+    assert catalog.search('brand42 biscuit', k=3)[0] == 'brand42 biscuit'
+
+
+def test_prompt_lists_only_relevant_items_for_large_catalogs(monkeypatch):
+    monkeypatch.setattr(agent, 'PROMPT_FULL_CATALOG_MAX', 10)
+    monkeypatch.setattr(agent, 'PROMPT_TOP_K', 5)
+    assert agent.prompt_items(Catalog(ITEMS), 'milk') == list(ITEMS)
+    names = agent.prompt_items(_big_catalog(), 'ek litre sarson tel')
+    assert names[0] == 'mustard oil' and len(names) <= 5
@@ -0,0 +1,69 @@
+import random
+import string
+
+import pytest
+
+import storage
+
+LONG = 'दो पैकेट दूध और एक किलो चावल भेज दीजिए, आपका ऑर्डर कन्फर्म हो गया है। ' * 2
+
+
+@pytest.fixture
+def compressed(store, monkeypatch):
+    monkeypatch.setattr(storage, 'COMPRESS_TEXT', True)
+    storage.init_db()
+    return store
+
+
+def test_pack_round_trips(compressed):
+    packed = storage.pack_text(LONG)
+    assert isinstance(packed, bytes) and len(packed) < len(LONG.encode('utf-8'))
+    assert storage.unpack_text(packed) == LONG
+
+
+def test_short_and_missing_text_stay_plain(compressed):
+    assert storage.pack_text('doodh') == 'doodh'
+    assert storage.pack_text(None) is None
+    assert storage.unpack_text('doodh') == 'doodh'
+    assert storage.unpack_text(None) is None
+
+
+def test_incompressible_text_stays_plain(compressed):
+    rng = random.Random(0)
+    noise = ''.join(rng.choice(string.printable) for _ in range(80))
+    assert storage.pack_text(noise) == noise
+
+
+def test_off_by_default(store):
+    assert storage.pack_text(LONG) == LONG
+
+
+def test_chat_is_stored_compressed_and_read_back(compressed):
+    storage.save_chat('user', LONG)
+    with storage.get_connection() as conn:
+        assert conn.execute("SELECT typeof(text) FROM chat_messages").fetchone()[0] == 'blob'
+    assert storage.load_chat()[0]['text'] == LONG
+
+
+def test_search_sees_compressed_text(compressed):
+    storage.save_chat('user', LONG)
+    storage.save_order(1, 'processing', [], LONG, 'ok', 0.0)
+    assert [r['source'] for r in storage.search('चावल')] == ['chat', 'order']
+
+
+def test_search_keeps_unpacking_until_no_blobs_remain(compressed, monkeypatch):
+    storage.save_chat('user', LONG)
+    monkeypatch.setattr(storage, 'COMPRESS_TEXT', False)
+    storage.init_db()
+    assert len(storage.search('चावल')) == 1
+
+
+def test_orders_reference_their_chat_messages(store):
+    request_id = storage.save_chat('user', 'do doodh')
+    storage.save_order(1, 'processing', [], 'do doodh', 'confirmed', 25.0, request_id)
+    reply_id = storage.save_chat('assistant', 'confirmed', order_id=1)
+    with storage.get_connection() as conn:
+        row = conn.execute("SELECT raw_request, response_text, request_msg_id, response_msg_id "
+                           "FROM orders WHERE id=1").fetchone()
+    assert row == (None, None, request_id, reply_id)
+    assert [r['source'] for r in storage.search('doodh')] == ['chat']
@@ -0,0 +1,83 @@
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import datatools
+import storage
+
+
+def _fill():
+    old = (datetime.utcnow() - timedelta(days=90)).isoformat()
+    items = [{'name': 'milk', 'qty': 2, 'unit_price': 25.0, 'line_total': 50.0}]
+    with storage.get_connection() as conn:
+        for oid in range(1, 6):
+            created = old if oid <= 3 else datetime.utcnow().isoformat()
+            conn.execute(
+                "INSERT INTO orders (id, created_at, status, total_amount, items_json, "
+                "raw_request, response_text) VALUES (?,?,?,?,?,?,?)",
+                (oid, created, 'delivered', 50.0, json.dumps(items), 'दो दूध, "quoted"\nline',
+                 None))
+            conn.execute("INSERT INTO order_items (order_id, item_name, qty, unit_price, "
+                         "line_total) VALUES (?,?,?,?,?)", (oid, 'milk', 2, 25.0, 50.0))
+            conn.execute("INSERT INTO chat_messages (ts, role, text) VALUES (?,?,?)",
+                         (old, 'user', f'message {oid}'))
+        conn.commit()
+    storage.save_chat('assistant', 'recent')
+    storage.archive_old_data(vacuum=False)
+
+
+def _dump():
+    return {t: [row for rows in storage.iter_table(t) for row in rows]
+            for t in storage.EXPORT_TABLES}
+
+
+@pytest.mark.parametrize('fmt', datatools.FORMATS)
+@pytest.mark.parametrize('archive_file', [False, True])
+def test_round_trip(store, monkeypatch, fmt, archive_file):
+    if archive_file:
+        monkeypatch.setattr(storage, 'ARCHIVE_DB_PATH', str(store / 'archive.db'))
+    storage.init_db()
+    _fill()
+    before = _dump()
+    assert before['orders_archive'] and before['order_rollups'] and before['item_rollups']
+    exported = datatools.export_data(str(store / 'out'), fmt)
+
+    monkeypatch.setattr(storage, 'DB_PATH', str(store / 'copy.db'))
+    if archive_file:
+        monkeypatch.setattr(storage, 'ARCHIVE_DB_PATH', str(store / 'copy.archive.db'))
+    assert datatools.import_data(str(store / 'out'), fmt) == exported
+    assert _dump() == before
+    assert storage.load_rollups()['order_count'] == 3
+    assert storage.allocate_order_id() == 6
+
+
+def test_skip_existing_reimports_nothing(store):
+    _fill()
+    out = str(store / 'out')
+    datatools.export_data(out)
+    datatools.import_data(out, skip_existing=True)
+    assert [o['id'] for o in storage.load_orders()] == [4, 5]
+    with pytest.raises(sqlite3.IntegrityError):
+        datatools.import_data(out)
+
+
+def test_compressed_text_exports_as_plain_text(store, monkeypatch):
+    monkeypatch.setattr(storage, 'COMPRESS_TEXT', True)
+    text = 'मुझे दो पैकेट दूध और एक ब्रेड चाहिए, जल्दी भेज दीजिए ' * 3
+    storage.save_chat('user', text)
+    datatools.export_data(str(store / 'out'))
+    with open(store / 'out' / 'chat_messages.jsonl', encoding='utf-8') as f:
+        assert json.loads(f.readline())['text'] == text
+
+
+def test_csv_from_before_new_columns_imports(store):
+    src = store / 'old'
+    src.mkdir()
+    (src / 'orders.csv').write_text(
+        'id,created_at,status,total_amount,raw_request,response_text,items_json\n'
+        '9,2024-01-01,processing,25.0,doodh,ok,\\N\n', encoding='utf-8')
+    assert datatools.import_data(str(src), 'csv') == {'orders': 1}
+    assert [o['id'] for o in storage.load_orders()] == [9]
+    assert storage.allocate_order_id() == 10
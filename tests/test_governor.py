@@ -0,0 +1,194 @@
+import threading
+import time
+
+import pytest
+
+from governor import PRIORITY_GREETING, PRIORITY_ORDER, ModelGovernor, ModelUnavailable
+
+
+class FakeModel:
+    """generate_content() echoes the prompt; calls block while `gate` is clear."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.gate = threading.Event()
+        self.gate.set()
+        self.prompts = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt):
+        with self._lock:
+            self.prompts.append(prompt)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            self.gate.wait(5)
+            if self.fail:
+                raise RuntimeError('quota exceeded')
+            return prompt
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def _governor(**kwargs):
+    kwargs = {'max_concurrency': 4, 'rate': 1000, 'burst': 1000, 'timeout': 5, **kwargs}
+    return ModelGovernor(**kwargs)
+
+
+def _start(fn, *args):
+    results = []
+
+    def run():
+        try:
+            results.append(fn(*args))
+        except Exception as e:
+            results.append(e)
+
+    t = threading.Thread(target=run)
+    t.start()
+    return t, results
+
+
+def _wait_for(cond, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_identical_prompts_share_one_call():
+    gov, model = _governor(), FakeModel()
+    model.gate.clear()
+    first, r1 = _start(gov.generate, model, 'p')
+    _wait_for(lambda: model.active == 1)
+    second, r2 = _start(gov.generate, model, 'p')
+    _wait_for(lambda: gov.metrics()['deduplicated'] == 1)
+    model.gate.set()
+    first.join()
+    second.join()
+    assert r1 == r2 == ['p']
+    assert model.prompts == ['p']
+
+
+def test_followers_get_the_owner_error():
+    gov, model = _governor(), FakeModel(fail=True)
+    model.gate.clear()
+    first, r1 = _start(gov.generate, model, 'p')
+    _wait_for(lambda: model.active == 1)
+    second, r2 = _start(gov.generate, model, 'p')
+    _wait_for(lambda: gov.metrics()['deduplicated'] == 1)
+    model.gate.set()
+    first.join()
+    second.join()
+    assert isinstance(r1[0], RuntimeError) and r2[0] is r1[0]
+    assert len(model.prompts) == 1
+
+
+def test_concurrency_is_capped():
+    gov, model = _governor(max_concurrency=2), FakeModel()
+    model.gate.clear()
+    threads = [_start(gov.generate, model, f'p{i}')[0] for i in range(5)]
+    _wait_for(lambda: model.active == 2)
+    time.sleep(0.05)
+    assert model.active == 2 and gov.metrics()['queue_depth'] == 3
+    model.gate.set()
+    for t in threads:
+        t.join()
+    assert model.max_active == 2
+    assert gov.metrics()['completed'] == 5
+
+
+def test_higher_priority_goes_first():
+    gov, model = _governor(max_concurrency=1), FakeModel()
+    model.gate.clear()
+    holder, _ = _start(gov.generate, model, 'held')
+    _wait_for(lambda: model.active == 1)
+    low, _ = _start(gov.generate, model, 'greeting', PRIORITY_GREETING)
+    _wait_for(lambda: gov.metrics()['queue_depth'] == 1)
+    high, _ = _start(gov.generate, model, 'order', PRIORITY_ORDER)
+    _wait_for(lambda: gov.metrics()['queue_depth'] == 2)
+    model.gate.set()
+    for t in (holder, low, high):
+        t.join()
+    assert model.prompts == ['held', 'order', 'greeting']
+
+
+def test_full_queue_rejects():
+    gov, model = _governor(max_concurrency=1, max_queue=1), FakeModel()
+    model.gate.clear()
+    holder, _ = _start(gov.generate, model, 'a')
+    _wait_for(lambda: model.active == 1)
+    queued, _ = _start(gov.generate, model, 'b')
+    _wait_for(lambda: gov.metrics()['queue_depth'] == 1)
+    with pytest.raises(ModelUnavailable):
+        gov.generate(model, 'c')
+    model.gate.set()
+    holder.join()
+    queued.join()
+    assert gov.metrics()['rejected_queue'] == 1
+
+
+def test_rate_limit_spaces_out_calls():
+    gov, model = _governor(rate=20, burst=1), FakeModel()
+    started = time.monotonic()
+    for i in range(4):
+        gov.generate(model, f'p{i}')
+    # One token up front, then one every 50 ms
+    assert time.monotonic() - started >= 0.14
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    gov, model = _governor(breaker_failures=2, breaker_cooldown=0.1), FakeModel(fail=True)
+    for i in range(2):
+        with pytest.raises(RuntimeError):
+            gov.generate(model, f'p{i}')
+    assert gov.metrics()['breaker'] == 'open'
+    with pytest.raises(ModelUnavailable):
+        gov.generate(model, 'p2')
+    assert len(model.prompts) == 2
+
+    time.sleep(0.12)
+    assert gov.metrics()['breaker'] == 'half-open'
+    model.fail = False
+    model.gate.clear()
+    probe, result = _start(gov.generate, model, 'probe')
+    _wait_for(lambda: model.active == 1)
+    with pytest.raises(ModelUnavailable):
+        gov.generate(model, 'other')
+    model.gate.set()
+    probe.join()
+    assert result == ['probe']
+    assert gov.metrics()['breaker'] == 'closed'
+    assert gov.metrics()['rejected_breaker'] == 2
+
+
+def test_failed_probe_reopens_the_breaker():
+    gov, model = _governor(breaker_failures=1, breaker_cooldown=0.05), FakeModel(fail=True)
+    with pytest.raises(RuntimeError):
+        gov.generate(model, 'a')
+    time.sleep(0.06)
+    with pytest.raises(RuntimeError):
+        gov.generate(model, 'b')
+    assert gov.metrics()['breaker'] == 'open'
+
+
+def test_timed_out_call_keeps_its_slot_until_it_finishes():
+    gov, model = _governor(max_concurrency=1), FakeModel()
+    model.gate.clear()
+    with pytest.raises(ModelUnavailable):
+        gov.generate(model, 'slow', timeout=0.05)
+    assert gov.metrics()['active'] == 1
+    model.gate.set()
+    _wait_for(lambda: gov.metrics()['active'] == 0)
+    assert gov.metrics()['timeouts'] == 1
+
+
+def test_slot_is_released_when_the_call_cannot_start():
+    gov = _governor(max_concurrency=1)
+    with pytest.raises(AttributeError):
+        gov.generate(None, 'p')
+    assert gov.metrics()['active'] == 0
+    assert gov.generate(FakeModel(), 'q') == 'q'
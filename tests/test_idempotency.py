@@ -0,0 +1,70 @@
+import pytest
+
+import agent
+import storage
+
+
+def test_claim_complete_and_replay(store):
+    assert storage.claim_message('k') is None
+    assert storage.claim_message('k')['status'] == 'pending'
+    storage.complete_message('k', {'intent': 'greeting'}, order_id=7)
+    record = storage.claim_message('k')
+    assert record['status'] == 'done'
+    assert record['parsed'] == {'intent': 'greeting'}
+    assert record['order_id'] == 7
+    assert record['reply_msg_id'] is None
+    storage.record_reply('k', 3)
+    assert storage.lookup_message('k')['reply_msg_id'] == 3
+
+
+def test_release_only_drops_pending_keys(store):
+    storage.claim_message('a')
+    storage.release_message('a')
+    assert storage.lookup_message('a') is None
+    storage.claim_message('b')
+    storage.complete_message('b', {'intent': 'greeting'})
+    storage.release_message('b')
+    assert storage.lookup_message('b')['status'] == 'done'
+
+
+def test_wait_gives_up_on_a_stuck_claim(store):
+    storage.claim_message('k')
+    assert storage.wait_for_message('k', timeout=0.05, poll=0.01) is None
+    assert storage.wait_for_message('missing', timeout=0.05) is None
+
+
+def test_repeat_is_replayed_without_a_model_call(session, parses):
+    first = agent.process_user_message(session, None, 'order milk', idempotency_key='k')
+    again = agent.process_user_message(session, None, 'order milk', idempotency_key='k')
+    assert parses == ['order milk']
+    assert again['__replayed'] and not first.get('__replayed')
+    assert again['order_id'] == first['order_id']
+    assert [o['id'] for o in storage.load_orders()] == [first['order_id']]
+
+
+def test_unknown_intent_releases_the_key(session, parses):
+    parsed = agent.process_user_message(session, None, 'garbled', idempotency_key='k')
+    assert parsed['intent'] == 'unknown'
+    assert storage.lookup_message('k') is None
+    agent.process_user_message(session, None, 'garbled', idempotency_key='k')
+    assert parses == ['garbled', 'garbled']
+
+
+def test_failed_pipeline_releases_the_key(session, monkeypatch):
+    def boom(state, model, user_text):
+        raise RuntimeError('model down')
+
+    monkeypatch.setattr(agent, 'gemini_parse', boom)
+    monkeypatch.setattr(agent, 'get_graph', lambda: None)
+    with pytest.raises(RuntimeError):
+        agent.process_user_message(session, None, 'hello', idempotency_key='k')
+    assert storage.lookup_message('k') is None
+
+
+def test_replay_says_whether_the_reply_was_saved(session, parses):
+    agent.process_user_message(session, None, 'hello', idempotency_key='k')
+    assert not agent.process_user_message(session, None, 'hello',
+                                          idempotency_key='k')['__reply_saved']
+    storage.record_reply('k', storage.save_chat('assistant', 'hi'))
+    assert agent.process_user_message(session, None, 'hello',
+                                      idempotency_key='k')['__reply_saved']
@@ -0,0 +1,66 @@
+import threading
+
+import storage
+
+
+def test_ids_count_up_within_a_block(store):
+    ids = storage.IdAllocator('t', block_size=5)
+    assert [ids.next_id() for _ in range(7)] == list(range(1, 8))
+
+
+def test_allocators_lease_disjoint_blocks(store):
+    # Two allocators stand in for two processes sharing the database
+    a = storage.IdAllocator('t', block_size=3)
+    b = storage.IdAllocator('t', block_size=3)
+    taken = [a.next_id(), b.next_id(), a.next_id(), b.next_id(), a.next_id(), a.next_id()]
+    assert len(set(taken)) == len(taken)
+
+
+def test_concurrent_threads_get_unique_ids(store):
+    allocators = [storage.IdAllocator('t', block_size=4) for _ in range(3)]
+    taken = []
+    lock = threading.Lock()
+
+    def worker(ids):
+        mine = [ids.next_id() for _ in range(50)]
+        with lock:
+            taken.extend(mine)
+
+    threads = [threading.Thread(target=worker, args=(allocators[i % 3],)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(taken) == len(set(taken)) == 300
+
+
+def test_sequence_starts_after_existing_orders(store):
+    storage.save_order(41, 'processing', [], 'x', 'ok', 0.0)
+    storage.init_db()
+    assert storage.IdAllocator('orders').next_id() == 42
+
+
+def test_each_store_has_its_own_sequence(store):
+    ids = storage.IdAllocator('t', block_size=2)
+    first = ids.next_id()
+    with storage.use_store('other'):
+        storage.init_db()
+        assert ids.next_id() == first
+    assert ids.next_id() == first + 1
+
+
+def test_reserve_hands_out_unused_ids(store):
+    ids = storage.IdAllocator('t', block_size=4)
+    assert ids.next_id() == 1
+    assert ids.reserve(3) == [2, 3, 4]
+    assert ids.reserve(0) == []
+    assert ids.next_id() == 5
+
+
+def test_reserve_larger_than_a_block(store):
+    ids = storage.IdAllocator('t', block_size=2)
+    ids.next_id()
+    reserved = ids.reserve(5)
+    assert reserved == list(range(reserved[0], reserved[0] + 5))
+    assert reserved[0] > 1
+    assert ids.next_id() not in reserved
@@ -0,0 +1,72 @@
+import pytest
+
+from resolver import NameIndex, edit_distance, index_for, resolve_item_name, tokens, transliterate
+
+CATALOG = {
+    'milk': {'hindi': ['doodh']},
+    'rice': {'hindi': ['chawal']},
+    'bread': {},
+    'maggi': {},
+    'sugar': {'hindi': ['cheeni']},
+    'toor dal': {'hindi': ['arhar dal']},
+    'moong dal': {},
+}
+
+
+@pytest.fixture(scope='module')
+def index():
+    return NameIndex(CATALOG)
+
+
+@pytest.mark.parametrize('name,sku', [
+    ('milk', 'milk'),
+    ('Doodh', 'milk'),
+    ('दूध', 'milk'),
+    ('2 packet doodh', 'milk'),
+    ('chaawal', 'rice'),
+    ('चावल', 'rice'),
+    ('maggie', 'maggi'),
+    ('chini', 'sugar'),
+    ('sugarr', 'sugar'),
+    ('tur daal', 'toor dal'),
+    ('arhar dal', 'toor dal'),
+])
+def test_resolves_variants(index, name, sku):
+    assert index.resolve(name) == sku
+
+
+@pytest.mark.parametrize('name', [
+    'rice flour',      # an unknown word: not rice
+    'milk chocolate',  # not milk either
+    'doodh chawal',    # two different items
+    'dal',             # toor or moong
+    'ice',             # too short to match fuzzily
+    'mil',
+    '',
+])
+def test_leaves_unclear_names_to_the_model(index, name):
+    assert index.resolve(name) is None
+
+
+def test_transliteration_and_tokens():
+    assert transliterate('दूध') == 'doodh'
+    assert transliterate('milk') == 'milk'
+    assert tokens('दो पैकेट दूध') == ['dud']
+
+
+def test_edit_distance_gives_up_past_the_limit():
+    assert edit_distance('kitten', 'sitting', 5) == 3
+    assert edit_distance('abc', 'xyzxyz', 1) == 2
+
+
+def test_index_is_built_once_per_catalog():
+    catalog = {'milk': {}}
+    first = index_for(catalog)
+    assert index_for(catalog) is first
+    assert index_for(dict(catalog)) is not first
+
+
+def test_keys_skip_the_index():
+    assert resolve_item_name(CATALOG, 'milk') == 'milk'
+    assert resolve_item_name(CATALOG, None) is None
+    assert resolve_item_name(CATALOG, 'doodh') == 'milk'
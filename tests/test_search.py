@@ -0,0 +1,80 @@
+import storage
+from render import search_result_html
+from storage import SNIPPET_CLOSE, SNIPPET_OPEN
+
+
+def _order(order_id, raw_request):
+    storage.save_order(order_id, 'processing', [], raw_request, 'ok', 0.0)
+
+
+def test_finds_chat_and_orders(store):
+    storage.save_chat('user', 'do packet doodh bhej do')
+    _order(1, 'ek kilo chawal aur doodh')
+    results = storage.search('doodh')
+    assert {r['source'] for r in results} == {'chat', 'order'}
+    assert all(SNIPPET_OPEN + 'doodh' + SNIPPET_CLOSE in r['snippet'] for r in results)
+
+
+def test_last_token_is_a_prefix(store):
+    storage.save_chat('user', 'maggi chahiye')
+    assert [r['source'] for r in storage.search('mag')] == ['chat']
+    assert storage.search('xyz') == []
+
+
+def test_query_syntax_is_quoted(store):
+    storage.save_chat('user', 'bread AND "milk"')
+    assert len(storage.search('bread AND "milk')) == 1
+    assert storage.search('NEAR(') == []
+    assert storage.search('  ') == []
+
+
+def test_hindi_words_stay_whole(store):
+    storage.save_chat('user', 'दूध चाहिए')
+    storage.save_chat('user', 'दाध')
+    results = storage.search('दूध')
+    assert len(results) == 1
+    assert results[0]['snippet'].startswith(SNIPPET_OPEN + 'दूध' + SNIPPET_CLOSE)
+
+
+def test_results_alternate_between_sources(store):
+    for i in range(3):
+        storage.save_chat('user', f'atta {i}')
+    for oid in (1, 2):
+        _order(oid, 'atta')
+    sources = [r['source'] for r in storage.search('atta')]
+    assert sources == ['chat', 'order', 'chat', 'order', 'chat']
+    assert len(storage.search('atta', limit=3)) == 3
+
+
+def test_index_follows_updates_and_deletes(store):
+    msg_id = storage.save_chat('user', 'sugar')
+    with storage.get_connection() as conn:
+        conn.execute("UPDATE chat_messages SET text='salt' WHERE id=?", (msg_id,))
+        conn.commit()
+    assert storage.search('sugar') == []
+    assert len(storage.search('salt')) == 1
+    with storage.get_connection() as conn:
+        conn.execute("DELETE FROM chat_messages WHERE id=?", (msg_id,))
+        conn.commit()
+    assert storage.search('salt') == []
+
+
+def test_old_tokenizer_index_is_rebuilt(store):
+    storage.save_chat('user', 'दूध')
+    storage.save_chat('user', 'दाध')
+    with storage.get_connection() as conn:
+        conn.execute("DROP TABLE chat_fts")
+        conn.execute("CREATE VIRTUAL TABLE chat_fts USING fts5("
+                     "text, content='chat_messages', content_rowid='id')")
+        conn.execute("INSERT INTO chat_fts(chat_fts) VALUES ('rebuild')")
+        conn.commit()
+    assert len(storage.search('दूध')) == 2
+    storage.init_db()
+    assert len(storage.search('दूध')) == 1
+
+
+def test_result_html_escapes_text_but_keeps_marks():
+    html = search_result_html('<b>', 'ts', f'[x](y) <i> {SNIPPET_OPEN}milk{SNIPPET_CLOSE}')
+    assert '<mark>milk</mark>' in html
+    assert '&lt;b&gt;' in html and '&lt;i&gt;' in html
+    assert '[' not in html